@@ -1,15 +1,17 @@
-from flask import Flask, request, jsonify
+from contextlib import closing
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+from flask_sock import Sock, ConnectionClosed
 import cv2
 import numpy as np
-from statistics import mode
-import tensorflow as tf
 import base64
+import json
 import os
 import sys
-import time  # <--- Added time for the delay logic
+import threading
+import time
+import traceback
 from dotenv import load_dotenv
-from openai import OpenAI
 
 # Load environment variables
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
@@ -17,123 +19,347 @@ load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 # Add parent directory to path to import utils
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from utils.inference import detect_faces, apply_offsets
-from utils.inference import load_detection_model
+from utils.inference import load_detection_model, detect_faces
+from utils.model_registry import registry as model_registry
+from utils.preprocessor import preprocess_faces
+from utils.tracker import FaceTracker
+from utils.smoothing import ProbabilitySmoother
+from interpreter_pool import InterpreterPool, PoolTimeout
+from batch_scheduler import BatchScheduler
+from session_store import SessionStore
+from llm_gateway import LLMGateway
+from frame_stream import LatestFrame, read_frames
+from metrics import MetricsRegistry, Counter, Gauge, Histogram
 
 app = Flask(__name__)
 CORS(app)
+sock = Sock(app)
 
 # --- CONFIGURATION ---
 detection_model_path = '../trained_models/detection_models/haarcascade_frontalface_default.xml'
 emotion_model_path = '../trained_models/emotion_models/emotion_model_large_v2.tflite'
 emotion_labels = ['angry', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise']
 
-# --- LOAD MODELS ---
-face_detection = load_detection_model(detection_model_path)
+# interpreters shared between request threads, each leased by one request at a time.
+# Every slot keeps one allocated interpreter per batch size bucket (1/2/4/8/16),
+# about 220 MB for the large emotion model, so the default pool stays small;
+# raise INTERPRETER_POOL_SIZE only on hosts with memory to match.
+interpreter_pool_size = int(os.environ.get('INTERPRETER_POOL_SIZE', min(2, os.cpu_count() or 1)))
+interpreter_num_threads = int(os.environ.get('INTERPRETER_NUM_THREADS', 1))
+interpreter_timeout = float(os.environ.get('INTERPRETER_TIMEOUT', 5.0))
+max_batch_size = 16
+
+# faces from concurrent requests are batched together for up to this long
+batch_max_delay = float(os.environ.get('BATCH_MAX_DELAY_MS', 5)) / 1000
 
-interpreter = tf.lite.Interpreter(model_path=emotion_model_path)
-interpreter.allocate_tensors()
+def warmup_interpreters(interpreters):
+    """Runs every pooled interpreter once on a single blank face."""
+    leased = [interpreters.acquire() for _ in range(interpreters.pool_size)]
+    try:
+        for interpreter in leased:
+            interpreter.predict(np.zeros((1,) + interpreter.input_shape,
+                                         interpreter.input_dtype))
+    finally:
+        for interpreter in leased:
+            interpreters.release(interpreter)
 
-input_details = interpreter.get_input_details()
-output_details = interpreter.get_output_details()
-emotion_target_size = (224, 224) 
+# --- LOAD MODELS ---
+# loaded once through the shared registry, warmed up in the background
+model_registry.register('face_detection',
+                        lambda: load_detection_model(detection_model_path),
+                        lambda model: detect_faces(model, np.zeros((64, 64), np.uint8)))
+model_registry.register('emotion_interpreters',
+                        lambda: InterpreterPool(emotion_model_path,
+                                                interpreter_pool_size,
+                                                interpreter_num_threads,
+                                                max_batch_size,
+                                                interpreter_timeout),
+                        warmup_interpreters)
+face_detection = model_registry.get('face_detection')
+emotion_interpreters = model_registry.get('emotion_interpreters')
+model_registry.start_warmup()
+emotion_scheduler = BatchScheduler(emotion_interpreters, max_batch_size,
+                                   batch_max_delay)
+emotion_target_size = emotion_interpreters.input_shape[:2]
 
 frame_window = 10
 emotion_offsets = (20, 40)
-emotion_windows = {}
 
-nebius_client = OpenAI(
-    base_url="https://api.tokenfactory.nebius.com/v1/",
-    api_key=os.environ.get("NEBIUS_API_KEY")
+# idle sessions are forgotten after session_ttl seconds, oldest first past max_sessions
+session_ttl = float(os.environ.get('SESSION_TTL', 600))
+max_sessions = int(os.environ.get('MAX_SESSIONS', 10000))
+emotion_wait_timeout = 3.0  # /chat waits up to 3 seconds for a first emotion
+# a waiting /chat request holds its WSGI thread; with a bounded thread pool, set
+# MAX_EMOTION_WAITERS so only that many wait at once and further chats without an
+# emotion yet fall back to the client-sent one right away. Unlimited by default
+max_emotion_waiters = int(os.environ.get('MAX_EMOTION_WAITERS', 0)) or None
+# full cascade detection runs every detect_every frames per session, faces are tracked in between
+detect_every = int(os.environ.get('DETECT_EVERY', 5))
+# with MIN_FACE_SIZE set, detection runs on a frame downscaled as far as faces of that size allow
+min_face_size = int(os.environ.get('MIN_FACE_SIZE', 0)) or None
+# per-face emotion is an exponential moving average of each track's probabilities
+smoothing_alpha = float(os.environ.get('SMOOTHING_ALPHA', 0.3))
+emotion_windows = SessionStore(frame_window, len(emotion_labels),
+                               session_ttl, max_sessions,
+                               lambda: FaceTracker(face_detection, detect_every,
+                                                   min_face_size=min_face_size),
+                               lambda: ProbabilitySmoother(len(emotion_labels),
+                                                           smoothing_alpha),
+                               max_emotion_waiters)
+
+# NEBIUS_BASE_URL can point at a local OpenAI-compatible server, see mock_llm_server.py
+nebius_gateway = LLMGateway(
+    base_url=os.environ.get("NEBIUS_BASE_URL", "https://api.tokenfactory.nebius.com/v1/"),
+    api_key=os.environ.get("NEBIUS_API_KEY"),
+    model="google/gemma-2-9b-it-fast",
+    max_in_flight=int(os.environ.get("LLM_MAX_IN_FLIGHT", 8)),
+    timeout=float(os.environ.get("LLM_TIMEOUT", 30.0)),
+    max_retries=int(os.environ.get("LLM_MAX_RETRIES", 2))
 )
 
+# --- METRICS ---
+metrics = MetricsRegistry()
+stage_seconds = metrics.register(Histogram(
+    'emotion_stage_seconds', 'Time spent in each stage of frame analysis.', ['stage']))
+frame_seconds = metrics.register(Histogram(
+    'emotion_frame_seconds', 'Total time to analyse one frame, decode included.', ['endpoint']))
+faces_total = metrics.register(Counter(
+    'emotion_faces_total', 'Faces classified.'))
+errors_total = metrics.register(Counter(
+    'emotion_errors_total', 'Failed requests and frames.', ['endpoint', 'reason']))
+metrics.register(Gauge(
+    'emotion_active_sessions', 'Sessions seen within SESSION_TTL.', emotion_windows.num_active))
+llm_buckets = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+llm_seconds = metrics.register(Histogram(
+    'llm_request_seconds', 'Duration of /chat completion calls.', ['mode'], llm_buckets))
+llm_first_token_seconds = metrics.register(Histogram(
+    'llm_time_to_first_token_seconds', 'Time to the first streamed /chat token.', (), llm_buckets))
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_chat(messages, emotion):
+    """Forwards the completion as server-sent events: a `token` event per
+    streamed chunk, then a `done` event with the full message and the time
+    to first token, or an `error` event if the upstream call fails."""
+    start_time = time.perf_counter()
+    time_to_first_token = None
+    tokens = []
+    try:
+        # closed explicitly when the client disconnects, which cancels the upstream call
+        with closing(nebius_gateway.stream(messages)) as token_stream:
+            for token in token_stream:
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - start_time
+                    llm_first_token_seconds.observe(time_to_first_token)
+                    print(f"Time to first token: {time_to_first_token * 1000:.0f} ms")
+                tokens.append(token)
+                yield sse_event('token', {'token': token})
+        llm_seconds.observe(time.perf_counter() - start_time, 'stream')
+        
+        yield sse_event('done', {
+            'message': ''.join(tokens),
+            'emotion': emotion,
+            'time_to_first_token_ms': None if time_to_first_token is None else time_to_first_token * 1000,
+            'total_time_ms': (time.perf_counter() - start_time) * 1000
+        })
+    except Exception as e:
+        errors_total.inc('chat', 'llm_error')
+        print(f"Error in /chat stream: {str(e)}")
+        traceback.print_exc()
+        yield sse_event('error', {'error': str(e)})
+
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({'status': 'ok'})
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    status = model_registry.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({'batching': emotion_scheduler.stats(),
+                    'llm': nebius_gateway.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.content_type)
+
+def read_frame():
+    """Returns the encoded frame bytes and session id of a /detect_emotion
+    request. Frames can be sent as a raw image body (session id in the
+    `session_id` query parameter or `X-Session-Id` header), as a multipart
+    `image` upload, or as the original JSON data URL. The bytes are empty
+    when the request carries no image, and ValueError is raised when the
+    JSON body is malformed."""
+    if request.mimetype == 'application/json':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            raise ValueError('JSON body must be an object')
+        image_data = data.get('image') or ''
+        if not isinstance(image_data, str):
+            raise ValueError('JSON image must be a data URL string')
+        session_id = data.get('session_id', 'default')
+        return base64.b64decode(image_data.split(',')[-1]), session_id
+
+    session_id = request.values.get('session_id',
+                                    request.headers.get('X-Session-Id', 'default'))
+    if request.mimetype == 'multipart/form-data':
+        image_file = request.files.get('image')
+        if image_file is None:
+            return b'', session_id
+        return image_file.read(), session_id
+    # raw JPEG/PNG body, decoded straight from the request buffer
+    return request.get_data(cache=False), session_id
+
+def analyze_frame(bgr_image, session_id):
+    """Detects every face in the frame, classifies them in one batch and
+    returns the per-face results sent back to the client."""
+    with stage_seconds.time('detect'):
+        gray_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
+        track_ids, faces = emotion_windows.tracker(session_id).update_tracks(gray_image)
+    
+    results = []
+    
+    # crops are taken from the BGR frame and batched in one float32 array
+    with stage_seconds.time('preprocess'):
+        rgb_faces, face_args = preprocess_faces(bgr_image, faces, emotion_offsets,
+                                                emotion_target_size, normalize=False)
+    if len(face_args) == 0:
+        return results
+    face_boxes = [faces[face_arg] for face_arg in face_args]
+    face_track_ids = [track_ids[face_arg] for face_arg in face_args]
+    
+    # one invoke for every face in the frame, batching wait included
+    with stage_seconds.time('invoke'):
+        emotion_predictions = emotion_scheduler.predict(rgb_faces)
+    with stage_seconds.time('smoothing'):
+        smoothed_predictions = emotion_windows.smoother(session_id).update(
+            face_track_ids, emotion_predictions)
+    faces_total.inc(amount=len(face_args))
+    
+    for track_id, face_coordinates, output_data, smoothed_data in zip(
+            face_track_ids, face_boxes, emotion_predictions, smoothed_predictions):
+        emotion_probability = float(np.max(output_data))
+        emotion_label_arg = int(np.argmax(output_data))
+        emotion_text = emotion_labels[emotion_label_arg]
+        
+        # the session window only feeds /chat, faces are smoothed per track
+        emotion_windows.append(session_id, emotion_label_arg)
+        emotion_smoothed = emotion_labels[int(np.argmax(smoothed_data))]
+        
+        if emotion_text == 'angry':
+            color = [int(emotion_probability * 255), 0, 0]
+        elif emotion_text == 'sad':
+            color = [0, 0, int(emotion_probability * 255)]
+        elif emotion_text == 'happy':
+            color = [int(emotion_probability * 255), int(emotion_probability * 255), 0]
+        elif emotion_text == 'surprise':
+            color = [0, int(emotion_probability * 255), int(emotion_probability * 255)]
+        else:
+            color = [0, int(emotion_probability * 255), 0]
+        
+        x, y, w, h = face_coordinates
+        results.append({
+            'emotion': emotion_smoothed,
+            'probability': emotion_probability,
+            'track_id': track_id,
+            'bbox': {'x': int(x), 'y': int(y), 'w': int(w), 'h': int(h)},
+            'color': color
+        })
+    
+    return results
+
 @app.route('/detect_emotion', methods=['POST'])
 def detect_emotion():
+    start_time = time.perf_counter()
     try:
-        data = request.json
-        image_data = data.get('image')
-        session_id = data.get('session_id', 'default')
-        
-        image_bytes = base64.b64decode(image_data.split(',')[1])
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        bgr_image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        bgr_image = None
+        with stage_seconds.time('decode'):
+            try:
+                image_bytes, session_id = read_frame()
+            except ValueError:
+                image_bytes = b''
+            # imdecode asserts on an empty buffer, so those are rejected first
+            if len(image_bytes) > 0:
+                nparr = np.frombuffer(image_bytes, np.uint8)
+                bgr_image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         
         if bgr_image is None:
+            errors_total.inc('detect_emotion', 'invalid_image')
             return jsonify({'error': 'Invalid image'}), 400
         
-        gray_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
-        rgb_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2RGB)
-        faces = detect_faces(face_detection, gray_image)
-        
-        results = []
-        
-        if session_id not in emotion_windows:
-            emotion_windows[session_id] = []
-        
-        for face_coordinates in faces:
-            x1, x2, y1, y2 = apply_offsets(face_coordinates, emotion_offsets)
-            
-            y1 = max(0, y1)
-            x1 = max(0, x1)
-            y2 = min(rgb_image.shape[0], y2)
-            x2 = min(rgb_image.shape[1], x2)
-            
-            rgb_face = rgb_image[y1:y2, x1:x2]
-            
+        faces = analyze_frame(bgr_image, session_id)
+        frame_seconds.observe(time.perf_counter() - start_time, 'detect_emotion')
+        return jsonify({'faces': faces})
+    
+    except PoolTimeout as e:
+        errors_total.inc('detect_emotion', 'pool_timeout')
+        return jsonify({'error': str(e)}), 503
+    
+    except Exception as e:
+        errors_total.inc('detect_emotion', 'exception')
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@sock.route('/ws/detect_emotion')
+def detect_emotion_ws(ws):
+    """Persistent alternative to polling /detect_emotion. The client sends
+    each encoded frame as a binary message (or a data URL text message) on
+    /ws/detect_emotion?session_id=..., and gets back one JSON message per
+    analysed frame. Only the newest frame is analysed when frames arrive
+    faster than inference; `dropped` counts the skipped ones."""
+    session_id = request.args.get('session_id', 'default')
+    frames = LatestFrame()
+    reader = threading.Thread(target=read_frames, args=(ws, frames), daemon=True)
+    reader.start()
+    
+    try:
+        while True:
+            frame = frames.get()
+            if frame is None:
+                break
+            frame_id, image_data = frame
+            start_time = time.perf_counter()
+            bgr_image = None
             try:
-                rgb_face = cv2.resize(rgb_face, emotion_target_size)
-            except:
+                with stage_seconds.time('decode'):
+                    if isinstance(image_data, str):
+                        image_data = base64.b64decode(image_data.split(',')[-1])
+                    if len(image_data) > 0:
+                        bgr_image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+            except (ValueError, cv2.error):
+                bgr_image = None
+            if bgr_image is None:
+                errors_total.inc('ws_detect_emotion', 'invalid_image')
+                ws.send(json.dumps({'frame': frame_id, 'error': 'Invalid image'}))
                 continue
             
-            rgb_face = rgb_face.astype(np.float32)
-            rgb_face = np.expand_dims(rgb_face, axis=0)
-            
-            interpreter.set_tensor(input_details[0]['index'], rgb_face)
-            interpreter.invoke()
-            output_data = interpreter.get_tensor(output_details[0]['index'])
-            
-            emotion_probability = float(np.max(output_data))
-            emotion_label_arg = int(np.argmax(output_data))
-            emotion_text = emotion_labels[emotion_label_arg]
-            
-            emotion_windows[session_id].append(emotion_text)
-            if len(emotion_windows[session_id]) > frame_window:
-                emotion_windows[session_id].pop(0)
-            
             try:
-                emotion_mode = mode(emotion_windows[session_id])
-            except:
-                emotion_mode = emotion_text
-            
-            if emotion_text == 'angry':
-                color = [int(emotion_probability * 255), 0, 0]
-            elif emotion_text == 'sad':
-                color = [0, 0, int(emotion_probability * 255)]
-            elif emotion_text == 'happy':
-                color = [int(emotion_probability * 255), int(emotion_probability * 255), 0]
-            elif emotion_text == 'surprise':
-                color = [0, int(emotion_probability * 255), int(emotion_probability * 255)]
-            else:
-                color = [0, int(emotion_probability * 255), 0]
+                faces = analyze_frame(bgr_image, session_id)
+            except PoolTimeout as e:
+                errors_total.inc('ws_detect_emotion', 'pool_timeout')
+                ws.send(json.dumps({'frame': frame_id, 'error': str(e)}))
+                continue
+            except Exception as e:
+                # a failed frame is reported, the session stays open
+                errors_total.inc('ws_detect_emotion', 'exception')
+                traceback.print_exc()
+                ws.send(json.dumps({'frame': frame_id, 'error': str(e)}))
+                continue
+            frame_seconds.observe(time.perf_counter() - start_time, 'ws_detect_emotion')
             
-            x, y, w, h = face_coordinates
-            results.append({
-                'emotion': emotion_mode,
-                'probability': emotion_probability,
-                'bbox': {'x': int(x), 'y': int(y), 'w': int(w), 'h': int(h)},
-                'color': color
-            })
-        
-        return jsonify({'faces': results})
-    
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+            ws.send(json.dumps({
+                'frame': frame_id,
+                'dropped': frames.num_dropped,
+                'faces': faces
+            }))
+    except ConnectionClosed:
+        pass
+    finally:
+        frames.close()
 
 @app.route('/chat', methods=['POST'])
 def chat():
@@ -145,20 +371,15 @@ def chat():
         conversation_history = data.get('history', [])
         
         # --- NEW LOGIC: WAIT FOR EMOTION ---
-        max_retries = 30  # Wait up to 3 seconds (30 * 0.1s)
-        current_retry = 0
-        
         # Check if we have detected ANY emotions for this user yet
-        # Loop while the history is empty or doesn't exist
+        # If not, block until /detect_emotion records the first one or we time out
         print(f"Checking emotion history for session: {session_id}")
-        while (session_id not in emotion_windows or len(emotion_windows[session_id]) == 0) and current_retry < max_retries:
-            time.sleep(0.1) # Sleep 100ms
-            current_retry += 1
+        emotion_mode_arg = emotion_windows.wait_mode(session_id, emotion_wait_timeout)
         
         # After waiting, try to get the server-side emotion
-        if session_id in emotion_windows and len(emotion_windows[session_id]) > 0:
+        if emotion_mode_arg is not None:
             # Calculate mode from the server's window
-            emotion = mode(emotion_windows[session_id])
+            emotion = emotion_labels[emotion_mode_arg]
             print(f"Captured real-time emotion after delay: {emotion}")
         else:
             # If still nothing (camera off? timeout?), fallback to passed emotion or neutral
@@ -198,12 +419,14 @@ def chat():
         })
         
         print(f"Sending request to Nebius with emotion: {emotion}")
-        response = nebius_client.chat.completions.create(
-            model="google/gemma-2-9b-it-fast",
-            messages=messages
-        )
+        if data.get('stream', False):
+            return Response(stream_with_context(stream_chat(messages, emotion)),
+                            mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache',
+                                     'X-Accel-Buffering': 'no'})
         
-        assistant_message = response.choices[0].message.content
+        with llm_seconds.time('complete'):
+            assistant_message = nebius_gateway.complete(messages)
         
         return jsonify({
             'message': assistant_message,
@@ -211,8 +434,8 @@ def chat():
         })
     
     except Exception as e:
+        errors_total.inc('chat', 'exception')
         print(f"Error in /chat endpoint: {str(e)}")
-        import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
@@ -0,0 +1,73 @@
+import numpy as np
+import tensorflow as tf
+
+
+class BatchInterpreter(object):
+    """TFLite interpreter that runs a whole (N, H, W, C) batch in a single
+    invoke. Resizing the input tensor forces a full re-allocation, so one
+    allocated interpreter is kept per batch size bucket: a batch is zero
+    padded up to the smallest bucket that holds it, which caps memory at
+    one interpreter per bucket whatever batch sizes arrive.
+
+    Instances are not thread-safe, use an `InterpreterPool` to share them
+    between request threads."""
+    def __init__(self, model_path, max_batch_size=16, num_threads=None,
+                 buckets=(1, 2, 4, 8, 16)):
+        self.model_path = model_path
+        self.max_batch_size = max_batch_size
+        self.num_threads = num_threads
+        self.buckets = sorted(set(
+            [bucket for bucket in buckets if bucket < max_batch_size] +
+            [max_batch_size]))
+        self.interpreters = {}
+
+        interpreter = self._get_interpreter(1)
+        input_details = interpreter.get_input_details()[0]
+        self.input_shape = tuple(input_details['shape'][1:])
+        self.input_dtype = input_details['dtype']
+
+    def _get_interpreter(self, batch_size):
+        interpreter = self.interpreters.get(batch_size)
+        if interpreter is None:
+            interpreter = tf.lite.Interpreter(model_path=self.model_path,
+                                              num_threads=self.num_threads)
+            input_index = interpreter.get_input_details()[0]['index']
+            input_shape = interpreter.get_input_details()[0]['shape']
+            if input_shape[0] != batch_size:
+                interpreter.resize_tensor_input(
+                    input_index, [batch_size] + list(input_shape[1:]))
+            interpreter.allocate_tensors()
+            self.interpreters[batch_size] = interpreter
+        return interpreter
+
+    def bucket_size(self, batch_size):
+        for bucket in self.buckets:
+            if bucket >= batch_size:
+                return bucket
+        return self.buckets[-1]
+
+    def _invoke(self, batch):
+        num_samples = len(batch)
+        bucket = self.bucket_size(num_samples)
+        if bucket > num_samples:
+            padded_batch = np.zeros((bucket,) + batch.shape[1:], batch.dtype)
+            padded_batch[:num_samples] = batch
+            batch = padded_batch
+        interpreter = self._get_interpreter(bucket)
+        input_index = interpreter.get_input_details()[0]['index']
+        output_index = interpreter.get_output_details()[0]['index']
+        interpreter.set_tensor(input_index, batch)
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index)[:num_samples]
+
+    def predict(self, batch):
+        """Returns the model output for every sample in `batch`. Batches
+        larger than `max_batch_size` are split into several invokes."""
+        batch = np.ascontiguousarray(batch, dtype=self.input_dtype)
+        if len(batch) <= self.max_batch_size:
+            return self._invoke(batch)
+        predictions = []
+        for start in range(0, len(batch), self.max_batch_size):
+            stop = start + self.max_batch_size
+            predictions.append(self._invoke(batch[start:stop]))
+        return np.concatenate(predictions)
@@ -0,0 +1,132 @@
+from collections import Counter
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+import queue
+import threading
+import time
+
+import numpy as np
+
+from interpreter_pool import PoolTimeout
+
+
+class BatchScheduler(object):
+    """Collects face batches from concurrent requests and runs them through
+    the interpreter pool as one larger batch.
+
+    A worker waits for the first pending request, then keeps collecting
+    requests until `max_batch_size` faces are queued or `max_delay` seconds
+    have passed, whichever comes first. Each request gets back only the
+    rows belonging to its own faces. `max_delay` bounds the latency added to
+    a request in exchange for bigger batches.
+
+    At most `max_pending` requests wait for a worker. A request that cannot
+    be queued, or gets no result, within `timeout` seconds (by default the
+    pool's lease timeout plus `max_delay`) raises `PoolTimeout`, so an
+    overloaded server answers 503 instead of queueing without limit.
+    """
+    def __init__(self, interpreter_pool, max_batch_size=16, max_delay=0.005,
+                 num_workers=None, max_pending=64, timeout=None):
+        self.interpreter_pool = interpreter_pool
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        if timeout is None:
+            timeout = interpreter_pool.timeout + max_delay
+        self.timeout = timeout
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.lock = threading.Lock()
+        self.batch_sizes = Counter()
+        self.num_requests = 0
+        if num_workers is None:
+            num_workers = interpreter_pool.pool_size
+        self.workers = []
+        for worker_arg in range(num_workers):
+            worker = threading.Thread(target=self._run, daemon=True,
+                                      name='batch-scheduler-%d' % worker_arg)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, faces):
+        """Queues `faces` for the next batch and returns a `Future` that
+        resolves to their predictions."""
+        future = Future()
+        try:
+            self.pending.put((faces, future), timeout=self.timeout)
+        except queue.Full:
+            raise PoolTimeout('No batch slot available after %.1fs' % self.timeout)
+        return future
+
+    def predict(self, faces):
+        future = self.submit(faces)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # a request still waiting in the queue is dropped from its batch
+            future.cancel()
+            raise PoolTimeout('No prediction after %.1fs' % self.timeout)
+
+    def _next_item(self, timeout=None):
+        """Returns the next pending request that was not cancelled, or
+        raises `queue.Empty` after `timeout` seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining_time = None
+            if deadline is not None:
+                remaining_time = max(deadline - time.monotonic(), 0)
+            item = self.pending.get(timeout=remaining_time)
+            if item[1].set_running_or_notify_cancel():
+                return item
+
+    def _collect(self, carried_item):
+        if carried_item is None:
+            items = [self._next_item()]
+        else:
+            items = [carried_item]
+        num_faces = len(items[0][0])
+        deadline = time.monotonic() + self.max_delay
+        while num_faces < self.max_batch_size:
+            remaining_time = deadline - time.monotonic()
+            if remaining_time <= 0:
+                break
+            try:
+                item = self._next_item(remaining_time)
+            except queue.Empty:
+                break
+            if num_faces + len(item[0]) > self.max_batch_size:
+                return items, item
+            items.append(item)
+            num_faces = num_faces + len(item[0])
+        return items, None
+
+    def _run(self):
+        carried_item = None
+        while True:
+            items, carried_item = self._collect(carried_item)
+            try:
+                batch = np.concatenate([faces for faces, future in items])
+                predictions = self.interpreter_pool.predict(batch)
+            except Exception as error:
+                for faces, future in items:
+                    future.set_exception(error)
+                continue
+
+            with self.lock:
+                self.batch_sizes[len(batch)] += 1
+                self.num_requests = self.num_requests + len(items)
+
+            start = 0
+            for faces, future in items:
+                stop = start + len(faces)
+                future.set_result(predictions[start:stop])
+                start = stop
+
+    def stats(self):
+        with self.lock:
+            num_batches = sum(self.batch_sizes.values())
+            num_faces = sum(size * count for size, count
+                            in self.batch_sizes.items())
+            return {'num_requests': self.num_requests,
+                    'num_batches': num_batches,
+                    'num_faces': num_faces,
+                    'mean_batch_size': num_faces / max(num_batches, 1),
+                    'batch_sizes': dict(sorted(self.batch_sizes.items()))}
@@ -0,0 +1,45 @@
+"""
+Per-frame emotion inference latency: one invoke per face versus a single
+batched invoke for every face in the frame.
+
+Run from the backend folder:
+    python benchmark_batching.py
+"""
+import time
+
+import numpy as np
+
+from batch_interpreter import BatchInterpreter
+
+emotion_model_path = '../trained_models/emotion_models/emotion_model_large_v2.tflite'
+face_counts = [1, 4, 16]
+num_frames = 20
+
+
+def time_frames(run_frame, faces):
+    run_frame(faces)  # warmup, also allocates the interpreter for this size
+    start_time = time.perf_counter()
+    for frame_arg in range(num_frames):
+        run_frame(faces)
+    return (time.perf_counter() - start_time) / num_frames * 1000
+
+
+if __name__ == '__main__':
+    interpreter = BatchInterpreter(emotion_model_path, max(face_counts))
+
+    def per_face(faces):
+        for face in faces:
+            interpreter.predict(face[np.newaxis])
+
+    def batched(faces):
+        interpreter.predict(faces)
+
+    print('faces  per-face (ms/frame)  batched (ms/frame)  speedup')
+    for num_faces in face_counts:
+        shape = (num_faces,) + interpreter.input_shape
+        faces = np.random.uniform(0, 255, shape).astype(np.float32)
+        per_face_time = time_frames(per_face, faces)
+        batched_time = time_frames(batched, faces)
+        print('%5d  %19.2f  %18.2f  %6.2fx' % (
+            num_faces, per_face_time, batched_time,
+            per_face_time / batched_time))
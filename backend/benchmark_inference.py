@@ -0,0 +1,219 @@
+"""
+Latency of every stage of the emotion inference path, and of a whole
+/detect_emotion request, on frames holding 0 to 16 faces.
+
+Run from the backend folder:
+    python benchmark_inference.py [face_image ...] [--compare old.json]
+Without images the frames are tiled from a drawn synthetic face the cascade
+detects; with images, the largest face found in each is tiled instead.
+Results are written to JSON so a later run can be compared against them.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# every request runs the cascade, instead of tracking faces between requests
+os.environ.setdefault('DETECT_EVERY', '1')
+os.environ.setdefault('NEBIUS_API_KEY', 'benchmark')
+
+from app import app, emotion_offsets, emotion_target_size, face_detection
+from batch_interpreter import BatchInterpreter
+from utils.inference import apply_offsets
+from utils.inference import detect_faces
+from utils.preprocessor import preprocess_faces
+from utils.preprocessor import preprocess_input
+
+emotion_model_path = '../trained_models/emotion_models/emotion_model_large_v2.tflite'
+keras_model_paths = [
+    '../trained_models/emotion_models/fer2013_mini_XCEPTION.102-0.66.hdf5',
+    '../trained_models/gender_models/simple_CNN.81-0.96.hdf5',
+    '../trained_models/gender_models/gender_mini_XCEPTION.21-0.95.hdf5']
+face_counts = [0, 1, 2, 4, 8, 16]
+cell_size = 160
+grid_size = 4
+num_warmup = 3
+
+
+def synthetic_face():
+    face = np.full((cell_size, cell_size), 110, np.uint8)
+    cv2.ellipse(face, (80, 85), (52, 66), 0, 0, 360, 190, -1)
+    for x in (60, 100):
+        cv2.ellipse(face, (x, 70), (12, 6), 0, 0, 360, 40, -1)
+        cv2.line(face, (x - 14, 56), (x + 12, 54), 60, 4)
+    cv2.line(face, (80, 75), (80, 100), 150, 4)
+    cv2.ellipse(face, (80, 118), (20, 7), 0, 0, 360, 70, -1)
+    face = cv2.GaussianBlur(face, (7, 7), 2)
+    return cv2.cvtColor(face, cv2.COLOR_GRAY2BGR)
+
+
+def fixture_face(image_path):
+    bgr_image = cv2.imread(image_path)
+    if bgr_image is None:
+        sys.exit('Could not read %s' % image_path)
+    gray_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
+    faces = detect_faces(face_detection, gray_image)
+    if len(faces) == 0:
+        sys.exit('No face found in %s' % image_path)
+    x, y, width, height = max(faces, key=lambda face: face[2] * face[3])
+    margin = width // 2
+    x1, x2 = max(0, x - margin), min(bgr_image.shape[1], x + width + margin)
+    y1, y2 = max(0, y - margin), min(bgr_image.shape[0], y + height + margin)
+    return cv2.resize(bgr_image[y1:y2, x1:x2], (cell_size, cell_size))
+
+
+def make_frame(face, num_faces):
+    """Places `num_faces` copies of `face` on a fixed-size grid, so only the
+    number of faces changes between frames."""
+    frame_size = cell_size * grid_size
+    bgr_image = np.full((frame_size, frame_size, 3), 110, np.uint8)
+    for face_arg in range(num_faces):
+        row, column = divmod(face_arg, grid_size)
+        bgr_image[row * cell_size:(row + 1) * cell_size,
+                  column * cell_size:(column + 1) * cell_size] = face
+    return bgr_image
+
+
+def crop_resize(bgr_image, faces, target_size):
+    rgb_faces = []
+    for face_coordinates in faces:
+        x1, x2, y1, y2 = apply_offsets(face_coordinates, emotion_offsets)
+        rgb_face = bgr_image[max(0, y1):y2, max(0, x1):x2]
+        rgb_face = cv2.cvtColor(rgb_face, cv2.COLOR_BGR2RGB)
+        rgb_faces.append(cv2.resize(rgb_face, target_size[::-1]))
+    return rgb_faces
+
+
+def time_stage(function, num_runs):
+    for run_arg in range(num_warmup):
+        function()
+    latencies = []
+    for run_arg in range(num_runs):
+        start_time = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start_time)
+    return np.array(latencies) * 1000
+
+
+def summarize(stage, fixture, num_faces, latencies):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {'stage': stage, 'fixture': fixture, 'num_faces': num_faces,
+            'runs': len(latencies), 'mean_ms': float(np.mean(latencies)),
+            'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99),
+            'faces_per_sec': num_faces * 1000 / float(np.mean(latencies))}
+
+
+def load_keras_models():
+    from keras.models import load_model
+    models = {}
+    for model_path in keras_model_paths:
+        if not os.path.exists(model_path):
+            print('Skipping missing model %s' % model_path)
+            continue
+        models[os.path.basename(model_path)] = load_model(model_path,
+                                                          compile=False)
+    return models
+
+
+def benchmark_frame(fixture, bgr_image, interpreter, keras_models, num_runs):
+    gray_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
+    faces = detect_faces(face_detection, gray_image)
+    num_faces = len(faces)
+    stages = [('detect_faces',
+               lambda: detect_faces(face_detection, gray_image))]
+
+    if num_faces > 0:
+        rgb_faces = np.stack(crop_resize(bgr_image, faces, emotion_target_size))
+        batch = preprocess_faces(bgr_image, faces, emotion_offsets,
+                                 emotion_target_size, normalize=False)[0]
+        stages.extend([
+            ('crop_resize',
+             lambda: crop_resize(bgr_image, faces, emotion_target_size)),
+            ('preprocess_input', lambda: preprocess_input(rgb_faces)),
+            ('preprocess_faces',
+             lambda: preprocess_faces(bgr_image, faces, emotion_offsets,
+                                      emotion_target_size, normalize=False)),
+            ('tflite_invoke', lambda: interpreter.predict(batch))])
+        for model_name, model in keras_models.items():
+            height, width, num_channels = model.input_shape[1:]
+            model_batch = preprocess_faces(bgr_image, faces, emotion_offsets,
+                                           (height, width),
+                                           grayscale=num_channels == 1)[0]
+            stages.append(('keras_predict:' + model_name,
+                           lambda model=model, model_batch=model_batch:
+                           model.predict(model_batch, verbose=0)))
+
+    image_bytes = cv2.imencode('.jpg', bgr_image)[1].tobytes()
+    client = app.test_client()
+
+    def detect_emotion():
+        response = client.post('/detect_emotion?session_id=benchmark',
+                               data=image_bytes, content_type='image/jpeg')
+        assert response.status_code == 200, response.get_data(as_text=True)
+    stages.append(('detect_emotion', detect_emotion))
+
+    return [summarize(stage, fixture, num_faces, time_stage(function, num_runs))
+            for stage, function in stages]
+
+
+def print_results(results, previous_results):
+    previous = {(result['stage'], result['fixture'], result['num_faces']):
+                result for result in previous_results}
+    print('%-12s %-48s %5s %9s %9s %9s %10s %9s' % (
+        'fixture', 'stage', 'faces', 'p50 ms', 'p95 ms', 'p99 ms', 'faces/s',
+        'p50 diff'))
+    for result in results:
+        key = (result['stage'], result['fixture'], result['num_faces'])
+        diff = ''
+        if key in previous:
+            diff = '%+8.1f%%' % (100 * (result['p50_ms'] /
+                                        previous[key]['p50_ms'] - 1))
+        print('%-12s %-48s %5d %9.2f %9.2f %9.2f %10.1f %9s' % (
+            result['fixture'][:12], result['stage'], result['num_faces'],
+            result['p50_ms'], result['p95_ms'], result['p99_ms'],
+            result['faces_per_sec'], diff))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('images', nargs='*',
+                        help='fixture images, each with at least one face')
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--output', default=time.strftime(
+        'benchmark_inference_%Y%m%d_%H%M%S.json'))
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    args = parser.parse_args()
+
+    fixtures = [('synthetic', synthetic_face())]
+    fixtures.extend((os.path.basename(image_path), fixture_face(image_path))
+                    for image_path in args.images)
+    interpreter = BatchInterpreter(emotion_model_path, max(face_counts))
+    keras_models = load_keras_models()
+
+    results = []
+    for fixture, face in fixtures:
+        for num_faces in face_counts:
+            print('%s: %d faces' % (fixture, num_faces))
+            results.extend(benchmark_frame(fixture, make_frame(face, num_faces),
+                                           interpreter, keras_models,
+                                           args.runs))
+
+    previous_results = []
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous_results = json.load(previous_file)['results']
+    print_results(results, previous_results)
+
+    with open(args.output, 'w') as output_file:
+        json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'platform': platform.platform(),
+                   'python': platform.python_version(),
+                   'opencv': cv2.__version__,
+                   'cpu_count': os.cpu_count(),
+                   'results': results}, output_file, indent=2)
+    print('Results written to %s' % args.output)
@@ -0,0 +1,52 @@
+"""
+Drives LLMGateway with many concurrent chat calls against the local mock
+server from mock_llm_server.py and prints its latency stats.
+
+Run from the backend folder:
+    python benchmark_llm_gateway.py
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+import mock_llm_server
+from llm_gateway import LLMGateway
+
+port = 8002
+num_clients = 32
+max_in_flight_values = [4, 16]
+messages = [{'role': 'user', 'content': 'hello'}]
+
+
+def start_mock_server():
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', port, mock_llm_server.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    server = start_mock_server()
+    base_url = 'http://127.0.0.1:%d/v1/' % port
+
+    print('max in flight  calls/s   p50 ms   p95 ms   p99 ms  errors')
+    for max_in_flight in max_in_flight_values:
+        gateway = LLMGateway(base_url, 'mock', 'mock',
+                             max_in_flight=max_in_flight, queue_timeout=60.0)
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(num_clients) as executor:
+            calls = [executor.submit(gateway.complete, messages)
+                     for client_arg in range(num_clients)]
+            for call in calls:
+                call.exception()
+        elapsed_time = time.perf_counter() - start_time
+        stats = gateway.stats()
+        print('%13d  %7.1f  %7.0f  %7.0f  %7.0f  %6d' % (
+            max_in_flight, num_clients / elapsed_time,
+            stats['latency_p50_ms'], stats['latency_p95_ms'],
+            stats['latency_p99_ms'], stats['num_errors']))
+    server.shutdown()
@@ -0,0 +1,48 @@
+"""
+Emotion inference throughput with many concurrent clients for different
+interpreter pool sizes.
+
+Run from the backend folder:
+    python benchmark_pool.py
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+import numpy as np
+
+from interpreter_pool import InterpreterPool
+
+emotion_model_path = '../trained_models/emotion_models/emotion_model_large_v2.tflite'
+num_clients = 16
+requests_per_client = 8
+faces_per_request = 1
+
+
+def run_client(pool, faces):
+    for request_arg in range(requests_per_client):
+        pool.predict(faces)
+
+
+if __name__ == '__main__':
+    num_cores = os.cpu_count() or 1
+    pool_sizes = sorted(set([1, 2, num_cores // 2, num_cores]) - set([0]))
+
+    print('pool size  requests/s')
+    for pool_size in pool_sizes:
+        pool = InterpreterPool(emotion_model_path, pool_size, num_threads=1,
+                               timeout=60.0)
+        shape = (faces_per_request,) + pool.input_shape
+        faces = np.random.uniform(0, 255, shape).astype(np.float32)
+        for interpreter in list(pool.interpreters.queue):
+            interpreter.predict(faces)
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(num_clients) as executor:
+            clients = [executor.submit(run_client, pool, faces)
+                       for client_arg in range(num_clients)]
+            for client in clients:
+                client.result()
+        elapsed_time = time.perf_counter() - start_time
+        num_requests = num_clients * requests_per_client
+        print('%9d  %10.1f' % (pool_size, num_requests / elapsed_time))
@@ -0,0 +1,51 @@
+import threading
+
+
+class LatestFrame(object):
+    """Single-slot mailbox between a WebSocket reader and the inference loop.
+
+    `put` overwrites any frame that has not been picked up yet, so when
+    inference falls behind the client frame rate the stale frames are
+    dropped and latency stays bounded by one frame.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.frame_id = 0
+        self.num_dropped = 0
+        self.closed = False
+
+    def put(self, frame):
+        with self.condition:
+            if self.frame is not None:
+                self.num_dropped = self.num_dropped + 1
+            self.frame_id = self.frame_id + 1
+            self.frame = frame
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def get(self):
+        """Waits for the newest frame and returns it with its id, or None
+        once the stream is closed."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame is not None or self.closed)
+            if self.frame is None:
+                return None
+            frame, self.frame = self.frame, None
+            return self.frame_id, frame
+
+
+def read_frames(ws, frames):
+    """Pushes every message received on `ws` into `frames` until the
+    connection closes."""
+    try:
+        while True:
+            frames.put(ws.receive())
+    except Exception:
+        pass
+    finally:
+        frames.close()
@@ -0,0 +1,49 @@
+from contextlib import contextmanager
+import queue
+
+from batch_interpreter import BatchInterpreter
+
+
+class PoolTimeout(Exception):
+    """Raised when no interpreter could be leased within the wait limit."""
+
+
+class InterpreterPool(object):
+    """Fixed-size pool of `BatchInterpreter`s. A TFLite interpreter must only
+    be used by one thread at a time, so each request leases one from the
+    pool and returns it when done. Concurrent requests then run on separate
+    interpreters instead of racing on a shared one."""
+    def __init__(self, model_path, pool_size=2, num_threads=None,
+                 max_batch_size=16, timeout=5.0):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.interpreters = queue.Queue(maxsize=pool_size)
+        for interpreter_arg in range(pool_size):
+            self.interpreters.put(BatchInterpreter(
+                model_path, max_batch_size, num_threads))
+        interpreter = self.interpreters.queue[0]
+        self.input_shape = interpreter.input_shape
+        self.input_dtype = interpreter.input_dtype
+
+    def acquire(self, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            return self.interpreters.get(timeout=timeout)
+        except queue.Empty:
+            raise PoolTimeout('No interpreter available after %.1fs' % timeout)
+
+    def release(self, interpreter):
+        self.interpreters.put_nowait(interpreter)
+
+    @contextmanager
+    def lease(self, timeout=None):
+        interpreter = self.acquire(timeout)
+        try:
+            yield interpreter
+        finally:
+            self.release(interpreter)
+
+    def predict(self, batch, timeout=None):
+        with self.lease(timeout) as interpreter:
+            return interpreter.predict(batch)
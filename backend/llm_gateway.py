@@ -0,0 +1,179 @@
+import asyncio
+from collections import deque
+import queue
+import random
+import threading
+import time
+
+import httpx
+import numpy as np
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+
+class LLMGateway(object):
+    """Chat completion calls made from Flask request threads, run on one
+    background asyncio loop with a keep-alive connection pool.
+
+    At most `max_in_flight` calls are sent upstream at once. Further calls
+    wait for a slot for up to `queue_timeout` seconds. Each attempt is
+    bounded by `timeout` seconds. Timeouts, connection errors, rate limits
+    and 5xx answers are retried up to `max_retries` times with jittered
+    exponential backoff. Latency of every call is recorded for `stats`.
+    A stream abandoned by its consumer is cancelled upstream and gives its
+    slot back right away.
+    """
+    retryable_errors = (openai.APITimeoutError, openai.APIConnectionError,
+                        openai.RateLimitError, openai.InternalServerError)
+
+    def __init__(self, base_url, api_key, model, max_in_flight=8,
+                 max_connections=16, timeout=30.0, queue_timeout=10.0,
+                 max_retries=2, backoff=0.5):
+        self.model = model
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=1000)
+        self.num_calls = 0
+        self.num_errors = 0
+        self.num_retries = 0
+        self.num_cancelled = 0
+        self.num_in_flight = 0
+        self.num_queued = 0
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True, name='llm-gateway')
+        self.thread.start()
+        self._run(self._start(base_url, api_key, max_connections, timeout))
+
+    async def _start(self, base_url, api_key, max_connections, timeout):
+        self.slots = asyncio.Semaphore(self.max_in_flight)
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections),
+            timeout=timeout)
+        self.client = AsyncOpenAI(base_url=base_url, api_key=api_key,
+                                  http_client=http_client, max_retries=0,
+                                  timeout=timeout)
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def _count(self, name, value):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    async def _acquire_slot(self):
+        self._count('num_queued', 1)
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+        finally:
+            self._count('num_queued', -1)
+        self._count('num_in_flight', 1)
+
+    def _release_slot(self):
+        self._count('num_in_flight', -1)
+        self.slots.release()
+
+    async def _create(self, messages, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.client.chat.completions.create(
+                    model=self.model, messages=messages, **kwargs)
+            except self.retryable_errors:
+                if attempt == self.max_retries:
+                    raise
+                self._count('num_retries', 1)
+                delay = self.backoff * 2 ** attempt
+                await asyncio.sleep(random.uniform(0, delay))
+
+    async def _complete(self, messages):
+        await self._acquire_slot()
+        try:
+            response = await self._create(messages)
+        finally:
+            self._release_slot()
+        return response.choices[0].message.content
+
+    def _record(self, start_time, failed, cancelled=False):
+        with self.lock:
+            self.num_calls = self.num_calls + 1
+            if failed:
+                self.num_errors = self.num_errors + 1
+            elif cancelled:
+                self.num_cancelled = self.num_cancelled + 1
+            else:
+                self.latencies.append(time.perf_counter() - start_time)
+
+    def complete(self, messages):
+        """Returns the assistant message for `messages`, blocking the
+        calling thread until it arrives."""
+        start_time = time.perf_counter()
+        try:
+            message = self._run(self._complete(messages))
+        except Exception:
+            self._record(start_time, True)
+            raise
+        self._record(start_time, False)
+        return message
+
+    async def _stream(self, messages, tokens):
+        try:
+            await self._acquire_slot()
+            try:
+                response = await self._create(messages, stream=True)
+                try:
+                    async for chunk in response:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            tokens.put(chunk.choices[0].delta.content)
+                finally:
+                    await response.close()
+            finally:
+                self._release_slot()
+        except Exception as error:
+            tokens.put(error)
+        tokens.put(None)
+
+    def stream(self, messages):
+        """Yields the assistant message token by token as the upstream
+        streams it back."""
+        start_time = time.perf_counter()
+        tokens = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(
+            self._stream(messages, tokens), self.loop)
+        outcome = 'cancelled'
+        try:
+            while True:
+                token = tokens.get()
+                if token is None:
+                    outcome = 'done'
+                    break
+                if isinstance(token, Exception):
+                    outcome = 'failed'
+                    raise token
+                yield token
+        finally:
+            # closing the generator early, e.g. when the SSE client goes
+            # away, stops the upstream read and frees the slot
+            future.cancel()
+            self._record(start_time, outcome == 'failed',
+                         outcome == 'cancelled')
+
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            stats = {'num_calls': self.num_calls,
+                     'num_errors': self.num_errors,
+                     'num_retries': self.num_retries,
+                     'num_cancelled': self.num_cancelled,
+                     'in_flight': self.num_in_flight,
+                     'queued': self.num_queued}
+        if len(latencies) > 0:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            stats.update({'latency_p50_ms': p50, 'latency_p95_ms': p95,
+                          'latency_p99_ms': p99})
+        return stats
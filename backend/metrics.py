@@ -0,0 +1,141 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+import time
+
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(label_names, label_values, extra=''):
+    pairs = ['%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                          .replace('"', '\\"').replace('\n', '\\n'))
+             for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    metric_type = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def header(self):
+        return ['# HELP %s %s' % (self.name, self.documentation),
+                '# TYPE %s %s' % (self.name, self.metric_type)]
+
+
+class Counter(Metric):
+    """Monotonic count, one per combination of label values."""
+    metric_type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = (self.values.get(label_values, 0) +
+                                         amount)
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            values = sorted(self.values.items())
+        for label_values, value in values:
+            lines.append('%s%s %s' % (
+                self.name, format_labels(self.label_names, label_values),
+                format_value(value)))
+        return lines
+
+
+class Gauge(Metric):
+    """Value read from `function` whenever the metrics are scraped."""
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, function):
+        Metric.__init__(self, name, documentation)
+        self.function = function
+
+    def render(self):
+        return self.header() + ['%s %s' % (self.name,
+                                           format_value(self.function()))]
+
+
+class Histogram(Metric):
+    """Cumulative bucket counts, sum and count of observed values, one set
+    per combination of label values. An observation is one bisect and a
+    few additions under a lock."""
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(),
+                 buckets=latency_buckets):
+        Metric.__init__(self, name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        bucket_arg = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = [[0] * (len(self.buckets) + 1), 0.0]
+                self.values[label_values] = series
+            series[0][bucket_arg] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observes the time spent in the `with` block, in seconds."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, *label_values)
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            values = sorted((label_values, (list(counts), total))
+                            for label_values, (counts, total)
+                            in self.values.items())
+        for label_values, (counts, total) in values:
+            cumulative_count = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative_count = cumulative_count + count
+                le = 'le="%s"' % format_value(bound)
+                lines.append('%s_bucket%s %d' % (
+                    self.name,
+                    format_labels(self.label_names, label_values, le),
+                    cumulative_count))
+            labels = format_labels(self.label_names, label_values)
+            lines.append('%s_sum%s %s' % (self.name, labels,
+                                          format_value(total)))
+            lines.append('%s_count%s %d' % (self.name, labels,
+                                            cumulative_count))
+        return lines
+
+
+class MetricsRegistry(object):
+    """Metrics rendered together in the Prometheus text exposition format."""
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,79 @@
+"""
+Local stand-in for the OpenAI-compatible chat completions API, so /chat can
+be exercised without network access or an API key.
+
+Run from the backend folder:
+    python mock_llm_server.py --port 8001
+then start the backend against it:
+    NEBIUS_BASE_URL=http://localhost:8001/v1/ NEBIUS_API_KEY=mock python app.py
+"""
+import argparse
+import json
+import time
+import uuid
+
+from flask import Flask, Response, request, jsonify
+
+app = Flask(__name__)
+
+reply = ('Thanks for sharing that with me. I am a local mock model, '
+         'so every answer sounds exactly like this one.')
+first_token_delay = 0.2
+token_delay = 0.02
+
+
+def completion_chunk(completion_id, model, delta, finish_reason=None):
+    return {'id': completion_id,
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'delta': delta,
+                         'finish_reason': finish_reason}]}
+
+
+def stream_completion(completion_id, model):
+    time.sleep(first_token_delay)
+    yield 'data: %s\n\n' % json.dumps(completion_chunk(
+        completion_id, model, {'role': 'assistant', 'content': ''}))
+    for token in reply.split(' '):
+        yield 'data: %s\n\n' % json.dumps(completion_chunk(
+            completion_id, model, {'content': token + ' '}))
+        time.sleep(token_delay)
+    yield 'data: %s\n\n' % json.dumps(completion_chunk(
+        completion_id, model, {}, 'stop'))
+    yield 'data: [DONE]\n\n'
+
+
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    data = request.json
+    model = data.get('model', 'mock')
+    completion_id = 'chatcmpl-' + uuid.uuid4().hex
+    if data.get('stream', False):
+        return Response(stream_completion(completion_id, model),
+                        mimetype='text/event-stream')
+
+    time.sleep(first_token_delay + token_delay * len(reply.split(' ')))
+    return jsonify({
+        'id': completion_id,
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0,
+                     'message': {'role': 'assistant', 'content': reply},
+                     'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': 0, 'completion_tokens': 0,
+                  'total_tokens': 0}
+    })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--first-token-delay', type=float,
+                        default=first_token_delay)
+    parser.add_argument('--token-delay', type=float, default=token_delay)
+    args = parser.parse_args()
+    first_token_delay = args.first_token_delay
+    token_delay = args.token_delay
+    app.run(host='127.0.0.1', port=args.port, threaded=True)
@@ -0,0 +1,166 @@
+from collections import OrderedDict
+import threading
+import time
+
+import numpy as np
+
+
+class EmotionWindow(object):
+    """Ring buffer of the last `size` emotion label args with per-label
+    counts kept up to date, so adding a label and reading the mode never
+    walk the window."""
+    def __init__(self, size, num_classes):
+        self.labels = np.zeros(size, dtype=np.int8)
+        self.counts = np.zeros(num_classes, dtype=np.int32)
+        self.position = 0
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def append(self, label_arg):
+        if self.length == len(self.labels):
+            self.counts[self.labels[self.position]] -= 1
+        else:
+            self.length = self.length + 1
+        self.labels[self.position] = label_arg
+        self.counts[label_arg] += 1
+        self.position = (self.position + 1) % len(self.labels)
+
+    def mode(self):
+        if self.length == 0:
+            return None
+        return int(np.argmax(self.counts))
+
+
+class Session(object):
+    def __init__(self, window):
+        self.last_seen = 0
+        self.window = window
+        self.tracker = None
+        self.smoother = None
+
+
+class SessionStore(object):
+    """Per-session emotion windows, face trackers and per-track probability
+    smoothers with bounded memory.
+
+    Sessions are kept in least-recently-used order. Sessions idle for more
+    than `ttl` seconds are dropped, and once `max_sessions` is reached the
+    least recently used session is evicted to make room for a new one.
+
+    Threads can block in `wait_mode` until a session records its first
+    label; they are woken by the `append` call that records it. Any number
+    of threads may wait by default; with a bounded thread pool,
+    `max_waiters` caps how many wait at once and `wait_mode` answers
+    immediately beyond that instead of tying up another thread.
+    """
+    def __init__(self, window_size=10, num_classes=7, ttl=600,
+                 max_sessions=10000, tracker_factory=None,
+                 smoother_factory=None, max_waiters=None):
+        self.window_size = window_size
+        self.num_classes = num_classes
+        self.tracker_factory = tracker_factory
+        self.smoother_factory = smoother_factory
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.waiters = {}
+        self.max_waiters = max_waiters
+        self.num_waiting = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def num_active(self):
+        """Number of sessions seen within the last `ttl` seconds."""
+        with self.lock:
+            self._evict(time.monotonic())
+            return len(self.sessions)
+
+    def _evict(self, now):
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if now - session.last_seen <= self.ttl:
+                break
+            del self.sessions[session_id]
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+
+    def _touch(self, session_id):
+        now = time.monotonic()
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = Session(EmotionWindow(self.window_size,
+                                            self.num_classes))
+            self.sessions[session_id] = session
+        else:
+            self.sessions.move_to_end(session_id)
+        session.last_seen = now
+        self._evict(now)
+        return session
+
+    def tracker(self, session_id):
+        """Returns the face tracker of the session, creating it on first
+        use."""
+        with self.lock:
+            session = self._touch(session_id)
+            if session.tracker is None:
+                session.tracker = self.tracker_factory()
+            return session.tracker
+
+    def smoother(self, session_id):
+        """Returns the per-track probability smoother of the session,
+        creating it on first use."""
+        with self.lock:
+            session = self._touch(session_id)
+            if session.smoother is None:
+                session.smoother = self.smoother_factory()
+            return session.smoother
+
+    def append(self, session_id, label_arg):
+        """Adds a label to the session window and returns the window mode."""
+        with self.lock:
+            window = self._touch(session_id).window
+            window.append(label_arg)
+            waiter = self.waiters.pop(session_id, None)
+            if waiter is not None:
+                waiter[0].set()
+            return window.mode()
+
+    def mode(self, session_id):
+        """Returns the most frequent label arg of the session window, or
+        None when the session has no labels yet."""
+        now = time.monotonic()
+        with self.lock:
+            self._evict(now)
+            if session_id not in self.sessions:
+                return None
+            return self.sessions[session_id].window.mode()
+
+    def wait_mode(self, session_id, timeout):
+        """Like `mode`, but if the session has no labels yet waits up to
+        `timeout` seconds for its first one, unless `max_waiters` is set
+        and that many threads are waiting already."""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None and len(session.window) > 0:
+                return session.window.mode()
+            if (self.max_waiters is not None
+                    and self.num_waiting >= self.max_waiters):
+                return None
+            self.num_waiting = self.num_waiting + 1
+            if session_id not in self.waiters:
+                self.waiters[session_id] = [threading.Event(), 0]
+            waiter = self.waiters[session_id]
+            waiter[1] = waiter[1] + 1
+
+        waiter[0].wait(timeout)
+
+        with self.lock:
+            self.num_waiting = self.num_waiting - 1
+            waiter[1] = waiter[1] - 1
+            if waiter[1] == 0 and self.waiters.get(session_id) is waiter:
+                del self.waiters[session_id]
+        return self.mode(session_id)
@@ -0,0 +1,209 @@
+"""
+Emotion and gender of every face in a recorded video, written as one record
+per face and frame.
+
+The video is split into frame ranges that a pool of processes analyses in
+parallel, each worker opening the file and seeking to its own range.
+Records are written in frame order as JSON lines or CSV, chosen by the
+output extension.
+
+Usage (from src/):
+    python analyze_video.py session.mp4 session.jsonl --workers 4
+    python analyze_video.py session.mp4 session.csv --every 5
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+
+import cv2
+import numpy as np
+
+from utils.datasets import get_labels
+from utils.inference import detect_faces
+from utils.inference import load_detection_model
+from utils.preprocessor import preprocess_faces
+
+detection_model_path = '../trained_models/detection_models/haarcascade_frontalface_default.xml'
+emotion_model_path = '../trained_models/emotion_models/fer2013_mini_XCEPTION.102-0.66.hdf5'
+gender_model_path = '../trained_models/gender_models/simple_CNN.81-0.96.hdf5'
+emotion_labels = get_labels('fer2013')
+gender_labels = get_labels('imdb')
+gender_offsets = (30, 60)
+emotion_offsets = (20, 40)
+record_fields = ['frame', 'timestamp', 'face', 'x', 'y', 'width', 'height',
+                 'emotion', 'emotion_probability', 'gender',
+                 'gender_probability']
+
+# loaded once in every worker process by load_models
+models = {}
+
+
+def load_models(emotion_model_path, gender_model_path, ready=None):
+    # one thread per process, the pool provides the parallelism
+    cv2.setNumThreads(1)
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    from keras.models import load_model
+    from utils.batched_inference import BucketedPredictor
+
+    models['face_detection'] = load_detection_model(detection_model_path)
+    models['emotion_classifier'] = BucketedPredictor(
+        load_model(emotion_model_path, compile=False))
+    models['gender_classifier'] = BucketedPredictor(
+        load_model(gender_model_path, compile=False))
+    if ready is not None:
+        ready.release()
+
+
+def analyze_frame(frame_arg, timestamp, bgr_image):
+    emotion_classifier = models['emotion_classifier']
+    gender_classifier = models['gender_classifier']
+    gray_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
+    faces = detect_faces(models['face_detection'], gray_image)
+
+    # gender offsets enclose the emotion offsets, so every face with an
+    # emotion crop also has a gender crop
+    gray_faces, face_args = preprocess_faces(
+        gray_image, faces, emotion_offsets,
+        emotion_classifier.input_shape[1:3], grayscale=True, v2=True)
+    faces = [faces[face_arg] for face_arg in face_args]
+    rgb_faces, face_args = preprocess_faces(
+        bgr_image, faces, gender_offsets,
+        gender_classifier.input_shape[1:3], v2=False)
+    if len(faces) == 0:
+        return []
+    emotion_predictions = emotion_classifier.predict(gray_faces)
+    gender_predictions = gender_classifier.predict(rgb_faces)
+
+    records = []
+    for face_arg, (x, y, width, height) in enumerate(faces):
+        emotion_prediction = emotion_predictions[face_arg]
+        gender_prediction = gender_predictions[face_arg]
+        records.append({
+            'frame': frame_arg, 'timestamp': round(timestamp, 3),
+            'face': face_arg, 'x': int(x), 'y': int(y),
+            'width': int(width), 'height': int(height),
+            'emotion': emotion_labels[int(np.argmax(emotion_prediction))],
+            'emotion_probability': float(np.max(emotion_prediction)),
+            'gender': gender_labels[int(np.argmax(gender_prediction))],
+            'gender_probability': float(np.max(gender_prediction))})
+    return records
+
+
+def analyze_range(task):
+    """Analyses every `every`-th frame in [start, stop) and returns the
+    records, the number of frames analysed and the time it took."""
+    video_path, start, stop, every, fps = task
+    start_time = time.perf_counter()
+    video_capture = cv2.VideoCapture(video_path)
+    video_capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+    records = []
+    num_frames = 0
+    for frame_arg in range(start, stop):
+        if (frame_arg - start) % every != 0:
+            if not video_capture.grab():
+                break
+            continue
+        ret, bgr_image = video_capture.read()
+        if not ret:
+            break
+        records.extend(analyze_frame(frame_arg, frame_arg / fps, bgr_image))
+        num_frames = num_frames + 1
+    video_capture.release()
+    return records, num_frames, time.perf_counter() - start_time
+
+
+def split_frames(num_frames, num_ranges, every):
+    """Splits [0, num_frames) into `num_ranges` ranges whose starts are
+    multiples of `every`, so the sampled frames match a single pass."""
+    range_size = int(np.ceil(num_frames / float(num_ranges) / every)) * every
+    return [(start, min(start + range_size, num_frames))
+            for start in range(0, num_frames, max(range_size, every))]
+
+
+class RecordWriter(object):
+    def __init__(self, output_path):
+        self.output_file = open(output_path, 'w', newline='')
+        self.csv_writer = None
+        if output_path.lower().endswith('.csv'):
+            self.csv_writer = csv.DictWriter(self.output_file, record_fields)
+            self.csv_writer.writeheader()
+
+    def write(self, records):
+        for record in records:
+            if self.csv_writer is not None:
+                self.csv_writer.writerow(record)
+            else:
+                self.output_file.write(json.dumps(record) + '\n')
+        self.output_file.flush()
+
+    def close(self):
+        self.output_file.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('video_path')
+    parser.add_argument('output_path', help='.jsonl or .csv file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--ranges-per-worker', type=int, default=4,
+                        help='more ranges balance the load between workers')
+    parser.add_argument('--every', type=int, default=1,
+                        help='analyse every n-th frame only')
+    parser.add_argument('--emotion-model', default=emotion_model_path)
+    parser.add_argument('--gender-model', default=gender_model_path)
+    args = parser.parse_args()
+
+    video_capture = cv2.VideoCapture(args.video_path)
+    if not video_capture.isOpened():
+        parser.error('Could not open %s' % args.video_path)
+    num_frames = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = video_capture.get(cv2.CAP_PROP_FPS) or 30.0
+    video_capture.release()
+
+    frame_ranges = split_frames(num_frames,
+                                args.workers * args.ranges_per_worker,
+                                args.every)
+    tasks = [(args.video_path, start, stop, args.every, fps)
+             for start, stop in frame_ranges]
+    print('%d frames at %.1f fps, %d ranges on %d workers' % (
+        num_frames, fps, len(tasks), args.workers))
+
+    # spawned workers, so none inherits TensorFlow state from this process
+    context = multiprocessing.get_context('spawn')
+    ready = context.Semaphore(0)
+    start_time = time.perf_counter()
+    pool = context.Pool(args.workers, load_models,
+                        (args.emotion_model, args.gender_model, ready))
+    # throughput is timed once every worker has loaded its models
+    for worker_arg in range(args.workers):
+        ready.acquire()
+    print('%d workers loaded the models in %.1f s' % (
+        args.workers, time.perf_counter() - start_time))
+    writer = RecordWriter(args.output_path)
+    start_time = time.perf_counter()
+    num_analysed, num_records, worker_time = 0, 0, 0.0
+    try:
+        # ranges come back in order, so records are written in frame order
+        for records, num_range_frames, range_time in pool.imap(analyze_range,
+                                                               tasks):
+            writer.write(records)
+            num_analysed = num_analysed + num_range_frames
+            num_records = num_records + len(records)
+            worker_time = worker_time + range_time
+    finally:
+        writer.close()
+        pool.terminate()
+    elapsed_time = time.perf_counter() - start_time
+
+    print('%d frames analysed, %d face records written to %s' % (
+        num_analysed, num_records, args.output_path))
+    print('%.1f frames/s overall, %.1f frames/s per worker, %.1f workers '
+          'busy on average' % (
+              num_analysed / elapsed_time,
+              num_analysed / max(worker_time, 1e-9),
+              worker_time / elapsed_time))
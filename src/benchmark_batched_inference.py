@@ -0,0 +1,70 @@
+"""
+Per-frame Keras inference latency: `model.predict` on one face at a time,
+`model.predict` on the whole frame, and a `BucketedPredictor` on the whole
+frame.
+
+Run from the src folder, optionally with the hdf5 models to time:
+    python benchmark_batched_inference.py
+    python benchmark_batched_inference.py ../trained_models/emotion_models/fer2013_mini_XCEPTION.102-0.66.hdf5
+"""
+import os
+import sys
+import time
+
+from keras.models import load_model
+import numpy as np
+
+from utils.batched_inference import BucketedPredictor
+
+model_paths = [
+    '../trained_models/emotion_models/fer2013_mini_XCEPTION.102-0.66.hdf5',
+    '../trained_models/gender_models/simple_CNN.81-0.96.hdf5',
+    '../trained_models/gender_models/gender_mini_XCEPTION.21-0.95.hdf5']
+face_counts = [1, 2, 3, 5, 8, 16]
+num_frames = 20
+
+
+def time_frames(run_frame, faces):
+    run_frame(faces)  # warmup, also traces this batch shape
+    start_time = time.perf_counter()
+    for frame_arg in range(num_frames):
+        run_frame(faces)
+    return (time.perf_counter() - start_time) / num_frames * 1000
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        model_paths = sys.argv[1:]
+    for model_path in model_paths:
+        if not os.path.exists(model_path):
+            print('skipping missing model %s' % model_path)
+            continue
+        model = load_model(model_path, compile=False)
+        predictor = BucketedPredictor(model)
+        start_time = time.perf_counter()
+        predictor.warmup()
+        warmup_time = time.perf_counter() - start_time
+
+        def per_face(faces):
+            for face in faces:
+                model.predict(face[np.newaxis], verbose=0)
+
+        def batched(faces):
+            model.predict(faces, verbose=0)
+
+        def bucketed(faces):
+            predictor.predict(faces)
+
+        print('%s, buckets traced in %.2f s' % (
+            os.path.basename(model_path), warmup_time))
+        print('faces  per-face predict  batched predict  bucketed  '
+              'speedup (ms/frame)')
+        for num_faces in face_counts:
+            shape = (num_faces,) + tuple(model.input_shape[1:])
+            faces = np.random.uniform(-1, 1, shape).astype(np.float32)
+            per_face_time = time_frames(per_face, faces)
+            batched_time = time_frames(batched, faces)
+            bucketed_time = time_frames(bucketed, faces)
+            print('%5d  %16.2f  %15.2f  %8.2f  %6.2fx' % (
+                num_faces, per_face_time, batched_time, bucketed_time,
+                per_face_time / bucketed_time))
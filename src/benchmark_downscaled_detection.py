@@ -0,0 +1,69 @@
+"""
+Recall and speed of detect_faces_downscaled against the full-resolution
+detect_faces, which is used as ground truth.
+
+Usage (from src/):
+    python benchmark_downscaled_detection.py image1.jpg [image2.jpg ...]
+"""
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from utils.inference import detect_faces
+from utils.inference import detect_faces_downscaled
+from utils.inference import get_detection_scale
+from utils.inference import load_detection_model
+from utils.tracker import compute_iou
+
+detection_model_path = '../trained_models/detection_models/haarcascade_frontalface_default.xml'
+min_face_sizes = [48, 64, 96, 128, 160]
+num_repeats = 3
+iou_threshold = 0.5
+
+
+def time_detection(detect, gray_images):
+    faces = [detect(gray_image) for gray_image in gray_images]
+    start_time = time.perf_counter()
+    for repeat_arg in range(num_repeats):
+        for gray_image in gray_images:
+            detect(gray_image)
+    elapsed_time = time.perf_counter() - start_time
+    return faces, elapsed_time / (num_repeats * len(gray_images)) * 1000
+
+
+def count_matches(faces, reference_faces):
+    return sum(any(compute_iou(face, reference_face) >= iou_threshold
+                   for face in faces)
+               for reference_face in reference_faces)
+
+
+if __name__ == '__main__':
+    gray_images = [cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+                   for image_path in sys.argv[1:]]
+    face_detection = load_detection_model(detection_model_path)
+
+    reference_faces, reference_time = time_detection(
+        lambda gray_image: detect_faces(face_detection, gray_image),
+        gray_images)
+    num_reference_faces = sum(len(faces) for faces in reference_faces)
+    print('full resolution: %.2f ms/image, %d faces' % (
+        reference_time, num_reference_faces))
+
+    print('min face size  scale  ms/image  speedup  recall  faces')
+    for min_face_size in min_face_sizes:
+        faces, detection_time = time_detection(
+            lambda gray_image: detect_faces_downscaled(
+                face_detection, gray_image, min_face_size), gray_images)
+        num_matches = sum(count_matches(image_faces, image_reference_faces)
+                          for image_faces, image_reference_faces
+                          in zip(faces, reference_faces))
+        scale = np.mean([get_detection_scale(face_detection, gray_image,
+                                             min_face_size)
+                         for gray_image in gray_images])
+        print('%13d  %5.2f  %8.2f  %6.2fx  %6.2f  %5d' % (
+            min_face_size, scale, detection_time,
+            reference_time / detection_time,
+            num_matches / float(max(num_reference_faces, 1)),
+            sum(len(image_faces) for image_faces in faces)))
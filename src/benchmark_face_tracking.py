@@ -0,0 +1,81 @@
+"""
+Detection time saved by FaceTracker compared with running detect_faces on
+every frame, and how closely the tracked boxes follow the detected ones.
+
+Usage (from src/):
+    python benchmark_face_tracking.py path/to/video.mp4
+    python benchmark_face_tracking.py path/to/image.jpg
+An image is turned into a short clip by slowly panning across it.
+"""
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from utils.inference import detect_faces
+from utils.inference import load_detection_model
+from utils.tracker import FaceTracker
+from utils.tracker import compute_iou
+
+detection_model_path = '../trained_models/detection_models/haarcascade_frontalface_default.xml'
+num_frames = 120
+detect_every_values = [1, 5, 10]
+
+
+def load_frames(path):
+    video_capture = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < num_frames:
+        ret, bgr_image = video_capture.read()
+        if not ret:
+            break
+        frames.append(cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY))
+    video_capture.release()
+    if len(frames) > 1:
+        return frames
+
+    gray_image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    frames = []
+    for frame_arg in range(num_frames):
+        shift = 20 * np.sin(2 * np.pi * frame_arg / num_frames)
+        transform = np.float32([[1, 0, shift], [0, 1, shift / 2]])
+        frames.append(cv2.warpAffine(gray_image, transform,
+                                     gray_image.shape[::-1],
+                                     borderMode=cv2.BORDER_REPLICATE))
+    return frames
+
+
+def mean_best_iou(boxes, reference_boxes):
+    if len(reference_boxes) == 0:
+        return 1.0 if len(boxes) == 0 else 0.0
+    scores = [max([compute_iou(box, reference_box) for box in boxes]
+                  or [0.0]) for reference_box in reference_boxes]
+    return float(np.mean(scores))
+
+
+if __name__ == '__main__':
+    frames = load_frames(sys.argv[1])
+    face_detection = load_detection_model(detection_model_path)
+
+    start_time = time.perf_counter()
+    detected_faces = [detect_faces(face_detection, frame) for frame in frames]
+    detection_time = (time.perf_counter() - start_time) / len(frames) * 1000
+
+    print('%d frames, %d faces per frame on average' % (
+        len(frames), np.mean([len(faces) for faces in detected_faces])))
+    print('detect every  ms/frame  detections  saved  mean IoU vs detection')
+    for detect_every in detect_every_values:
+        face_tracker = FaceTracker(face_detection, detect_every)
+        tracked_faces = []
+        start_time = time.perf_counter()
+        for frame in frames:
+            tracked_faces.append(face_tracker.update(frame))
+        tracking_time = (time.perf_counter() - start_time) / len(frames) * 1000
+        agreement = np.mean([mean_best_iou(boxes, reference_boxes)
+                             for boxes, reference_boxes
+                             in zip(tracked_faces, detected_faces)])
+        print('%12d  %8.2f  %10d  %4.0f%%  %21.3f' % (
+            detect_every, tracking_time, face_tracker.num_detections,
+            100 * (1 - tracking_time / detection_time), agreement))
+    print('detect_faces on every frame: %.2f ms/frame' % detection_time)
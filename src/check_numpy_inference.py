@@ -0,0 +1,81 @@
+"""
+Checks that `NumpyModel` matches Keras on the same hdf5 models and compares
+their latency.
+
+Every model runs on random batches through both Keras and NumPy. The
+script prints the largest absolute difference in the outputs and the share
+of faces given the same class, and exits with status 1 when a difference
+is above --tolerance.
+
+Run from the src folder, optionally with the hdf5 models to check:
+    python check_numpy_inference.py
+    python check_numpy_inference.py ../trained_models/gender_models/simple_CNN.81-0.96.hdf5
+"""
+import argparse
+import os
+import sys
+import time
+
+from keras.models import load_model
+import numpy as np
+
+from utils.numpy_inference import NumpyModel
+
+model_paths = [
+    '../trained_models/emotion_models/fer2013_mini_XCEPTION.102-0.66.hdf5',
+    '../trained_models/gender_models/simple_CNN.81-0.96.hdf5',
+    '../trained_models/gender_models/gender_mini_XCEPTION.21-0.95.hdf5']
+batch_sizes = [1, 8, 32]
+num_runs = 10
+
+
+def time_predict(predict, faces):
+    start_time = time.perf_counter()
+    for run_arg in range(num_runs):
+        predict(faces)
+    return (time.perf_counter() - start_time) / num_runs * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('model_paths', nargs='*', default=model_paths)
+    parser.add_argument('--tolerance', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    passed = True
+    for model_path in args.model_paths:
+        if not os.path.exists(model_path):
+            print('skipping missing model %s' % model_path)
+            continue
+        start_time = time.perf_counter()
+        numpy_model = NumpyModel(model_path)
+        load_time = time.perf_counter() - start_time
+        keras_model = load_model(model_path, compile=False)
+        print('%s, loaded with NumPy in %.3f s' % (
+            os.path.basename(model_path), load_time))
+        print('batch  max difference  same class  keras (ms)  numpy (ms)')
+        for batch_size in batch_sizes:
+            shape = (batch_size,) + tuple(keras_model.input_shape[1:])
+            faces = np.random.uniform(-1, 1, shape).astype(np.float32)
+            keras_outputs = keras_model.predict(faces, verbose=0)
+            numpy_outputs = numpy_model.predict(faces)
+            if not isinstance(keras_outputs, list):
+                keras_outputs, numpy_outputs = [keras_outputs], [numpy_outputs]
+            difference = max(np.max(np.abs(keras_output - numpy_output))
+                             for keras_output, numpy_output
+                             in zip(keras_outputs, numpy_outputs))
+            agreement = np.mean([
+                np.mean(np.argmax(keras_output, -1) == np.argmax(numpy_output, -1))
+                for keras_output, numpy_output
+                in zip(keras_outputs, numpy_outputs)])
+            keras_time = time_predict(
+                lambda faces: keras_model.predict(faces, verbose=0), faces)
+            numpy_time = time_predict(numpy_model.predict, faces)
+            print('%5d  %14.2e  %9.1f%%  %10.2f  %10.2f' % (
+                batch_size, difference, 100 * agreement, keras_time,
+                numpy_time))
+            if difference > args.tolerance:
+                passed = False
+    if not passed:
+        print('outputs differ by more than %g' % args.tolerance)
+        sys.exit(1)
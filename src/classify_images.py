@@ -0,0 +1,271 @@
+"""
+Emotion and gender of every face in a directory of images.
+
+Images are streamed from the directory tree and decoded and searched for
+faces on a thread pool. Face crops of several images are classified
+together in one model call per batch. Every image gets one JSON line in the
+output, written as soon as its batch is done, so an interrupted run picks up
+where it stopped when started again with the same output file. Annotated
+copies of the images are written only when --annotated-dir is given.
+
+Usage (from src/):
+    python classify_images.py ../images/ predictions.jsonl
+    python classify_images.py photos/ predictions.jsonl --annotated-dir annotated/
+"""
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import threading
+import time
+
+import cv2
+from keras.models import load_model
+import numpy as np
+
+from utils.datasets import get_labels
+from utils.inference import detect_faces
+from utils.inference import draw_text
+from utils.inference import draw_bounding_box
+from utils.inference import load_detection_model
+from utils.preprocessor import preprocess_faces
+
+# parameters for loading data and images
+detection_model_path = '../trained_models/detection_models/haarcascade_frontalface_default.xml'
+emotion_model_path = '../trained_models/emotion_models/fer2013_mini_XCEPTION.102-0.66.hdf5'
+gender_model_path = '../trained_models/gender_models/simple_CNN.81-0.96.hdf5'
+emotion_labels = get_labels('fer2013')
+gender_labels = get_labels('imdb')
+image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+# hyper-parameters for bounding boxes shape
+gender_offsets = (10, 10)
+emotion_offsets = (0, 0)
+
+
+def list_images(image_dir):
+    """Yields the image paths under `image_dir`, relative to it, in a
+    stable order without listing the whole tree first."""
+    for root, dirnames, filenames in os.walk(image_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(image_extensions):
+                yield os.path.relpath(os.path.join(root, filename), image_dir)
+
+
+def load_done_images(output_path):
+    """Returns the images already in `output_path`. A line cut short by an
+    interrupted run is removed so appending starts on a clean line."""
+    done_images = set()
+    if not os.path.exists(output_path):
+        return done_images
+    with open(output_path, 'rb+') as output_file:
+        valid_size = 0
+        for line in output_file:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                done_images.add(json.loads(line)['image'])
+            except (ValueError, KeyError):
+                break
+            valid_size = valid_size + len(line)
+        output_file.truncate(valid_size)
+    return done_images
+
+
+# every decoding thread keeps its own cascade, as OpenCV does not promise
+# that one cascade can detect on several threads at once
+thread_models = threading.local()
+
+
+def load_and_detect(image_dir, image_name):
+    face_detection = getattr(thread_models, 'face_detection', None)
+    if face_detection is None:
+        face_detection = load_detection_model(detection_model_path)
+        thread_models.face_detection = face_detection
+    bgr_image = cv2.imread(os.path.join(image_dir, image_name))
+    if bgr_image is None:
+        return image_name, None, None, []
+    gray_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
+    faces = detect_faces(face_detection, gray_image)
+    return image_name, bgr_image, gray_image, list(faces)
+
+
+def read_ahead(executor, function, items, num_ahead):
+    """Like `executor.map`, but keeps at most `num_ahead` items in flight,
+    so a huge directory is never queued up at once."""
+    futures = deque()
+    for item in items:
+        futures.append(executor.submit(function, item))
+        if len(futures) >= num_ahead:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+class BatchClassifier(object):
+    """Collects detected images until `batch_size` faces are waiting, then
+    classifies all their faces with one call per model."""
+    def __init__(self, emotion_classifier, gender_classifier, batch_size):
+        self.emotion_classifier = emotion_classifier
+        self.gender_classifier = gender_classifier
+        self.emotion_target_size = emotion_classifier.input_shape[1:3]
+        self.gender_target_size = gender_classifier.input_shape[1:3]
+        self.batch_size = batch_size
+        self.images = []
+        self.num_faces = 0
+
+    def add(self, image):
+        """Adds a detected image and returns the classified batch once it
+        is full, else an empty list."""
+        self.images.append(image)
+        self.num_faces = self.num_faces + len(image[3])
+        if (self.num_faces >= self.batch_size or
+                len(self.images) >= self.batch_size):
+            return self.flush()
+        return []
+
+    def flush(self):
+        """Classifies the waiting images and returns, for each, its name,
+        image, faces, emotion predictions and gender predictions."""
+        gray_batch, rgb_batch, image_faces = [], [], []
+        for image_name, bgr_image, gray_image, faces in self.images:
+            if bgr_image is None or len(faces) == 0:
+                image_faces.append([])
+                continue
+            # gender offsets enclose the emotion offsets, so every face
+            # with an emotion crop also has a gender crop
+            gray_faces, face_args = preprocess_faces(
+                gray_image, faces, emotion_offsets, self.emotion_target_size,
+                grayscale=True, v2=True)
+            faces = [faces[face_arg] for face_arg in face_args]
+            rgb_faces, face_args = preprocess_faces(
+                bgr_image, faces, gender_offsets, self.gender_target_size,
+                v2=False)
+            gray_batch.append(gray_faces)
+            rgb_batch.append(rgb_faces)
+            image_faces.append(faces)
+
+        num_faces = sum(len(faces) for faces in image_faces)
+        if num_faces > 0:
+            emotion_predictions = self.emotion_classifier.predict(
+                np.concatenate(gray_batch), batch_size=num_faces, verbose=0)
+            gender_predictions = self.gender_classifier.predict(
+                np.concatenate(rgb_batch), batch_size=num_faces, verbose=0)
+
+        results, face_start = [], 0
+        for (image_name, bgr_image, gray_image, _), faces in zip(self.images,
+                                                                 image_faces):
+            face_stop = face_start + len(faces)
+            if len(faces) == 0:
+                results.append((image_name, bgr_image, faces, [], []))
+            else:
+                results.append((image_name, bgr_image, faces,
+                                emotion_predictions[face_start:face_stop],
+                                gender_predictions[face_start:face_stop]))
+            face_start = face_stop
+        self.images = []
+        self.num_faces = 0
+        return results
+
+
+def to_record(image_name, bgr_image, faces, emotion_predictions,
+              gender_predictions):
+    if bgr_image is None:
+        return {'image': image_name, 'error': 'could not decode image'}
+    face_records = []
+    for face_arg, (x, y, width, height) in enumerate(faces):
+        emotion_prediction = emotion_predictions[face_arg]
+        gender_prediction = gender_predictions[face_arg]
+        face_records.append({
+            'x': int(x), 'y': int(y), 'width': int(width),
+            'height': int(height),
+            'emotion': emotion_labels[int(np.argmax(emotion_prediction))],
+            'emotion_probability': float(np.max(emotion_prediction)),
+            'gender': gender_labels[int(np.argmax(gender_prediction))],
+            'gender_probability': float(np.max(gender_prediction))})
+    return {'image': image_name, 'faces': face_records}
+
+
+def write_annotated(annotated_path, bgr_image, record):
+    for face in record['faces']:
+        face_coordinates = (face['x'], face['y'], face['width'],
+                            face['height'])
+        # colors are BGR, boxes are drawn straight onto the loaded image
+        if face['gender'] == gender_labels[0]:
+            color = (255, 0, 0)
+        else:
+            color = (0, 0, 255)
+        draw_bounding_box(face_coordinates, bgr_image, color)
+        draw_text(face_coordinates, bgr_image, face['gender'],
+                  color, 0, -20, 1, 2)
+        draw_text(face_coordinates, bgr_image, face['emotion'],
+                  color, 0, -50, 1, 2)
+    os.makedirs(os.path.dirname(annotated_path) or '.', exist_ok=True)
+    cv2.imwrite(annotated_path, bgr_image)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('image_dir')
+    parser.add_argument('output_path', help='JSON lines file, resumed if '
+                        'it already exists')
+    parser.add_argument('--annotated-dir', default=None,
+                        help='also write annotated images here')
+    parser.add_argument('--batch-size', type=int, default=64,
+                        help='faces classified per model call')
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1,
+                        help='threads decoding images and detecting faces')
+    parser.add_argument('--emotion-model', default=emotion_model_path)
+    parser.add_argument('--gender-model', default=gender_model_path)
+    args = parser.parse_args()
+
+    # loading models
+    emotion_classifier = load_model(args.emotion_model, compile=False)
+    gender_classifier = load_model(args.gender_model, compile=False)
+    batch_classifier = BatchClassifier(emotion_classifier, gender_classifier,
+                                       args.batch_size)
+
+    done_images = load_done_images(args.output_path)
+    if done_images:
+        print('resuming, %d images already done' % len(done_images))
+    image_names = (image_name for image_name in list_images(args.image_dir)
+                   if image_name not in done_images)
+
+    # OpenCV releases the GIL while decoding and detecting, so threads
+    # overlap that work; the models run on this thread
+    executor = ThreadPoolExecutor(args.threads)
+    output_file = open(args.output_path, 'a')
+    start_time = time.perf_counter()
+    num_images, num_faces = 0, 0
+
+    def write_results(results):
+        global num_images, num_faces
+        for result in results:
+            record = to_record(*result)
+            output_file.write(json.dumps(record) + '\n')
+            if args.annotated_dir is not None and 'faces' in record:
+                write_annotated(os.path.join(args.annotated_dir, record['image']),
+                                result[1], record)
+            num_images = num_images + 1
+            num_faces = num_faces + len(record.get('faces', []))
+        output_file.flush()
+
+    try:
+        images = read_ahead(
+            executor,
+            lambda image_name: load_and_detect(args.image_dir, image_name),
+            image_names, 4 * args.threads)
+        for image in images:
+            write_results(batch_classifier.add(image))
+        write_results(batch_classifier.flush())
+    finally:
+        output_file.close()
+        executor.shutdown(cancel_futures=True)
+
+    elapsed_time = time.perf_counter() - start_time
+    print('%d images, %d faces in %.1f s, %.1f images/s, %.1f faces/s' % (
+        num_images, num_faces, elapsed_time,
+        num_images / max(elapsed_time, 1e-9),
+        num_faces / max(elapsed_time, 1e-9)))
@@ -0,0 +1,230 @@
+"""
+Exports a Keras classifier to TFLite as float32, float16 and full-int8, and
+reports size, latency and accuracy of every variant against the Keras model.
+
+The model is either a trained hdf5 file or the name of an architecture in
+models/cnn.py (built with --input-shape and --num-classes, optionally
+loading --weights). The int8 variant is calibrated on training faces drawn
+through DataManager; validation faces give the accuracy of every variant.
+Without the dataset on disk, calibration falls back to random inputs and
+only agreement with the Keras predictions is reported.
+
+Usage (from src/):
+    python export_tflite.py ../trained_models/gender_models/gender_mini_XCEPTION.21-0.95.hdf5 --dataset imdb
+    python export_tflite.py mini_XCEPTION --input-shape 64 64 1 --num-classes 7
+"""
+import argparse
+import json
+import os
+import time
+
+import cv2
+from keras.models import load_model
+import numpy as np
+import tensorflow as tf
+
+from models import cnn
+from utils.datasets import DataManager
+from utils.datasets import split_data
+from utils.datasets import split_imdb_data
+from utils.preprocessor import preprocess_input
+
+imdb_images_path = '../datasets/imdb_crop/'
+validation_split = .2
+variants = ['float32', 'float16', 'int8']
+
+
+def build_model(args):
+    if os.path.exists(args.model):
+        return load_model(args.model, compile=False)
+    architecture = getattr(cnn, args.model)
+    model = architecture(tuple(args.input_shape), args.num_classes)
+    if args.weights is not None:
+        model.load_weights(args.weights)
+    return model
+
+
+def load_imdb_faces(keys, ground_truth_data, input_shape):
+    height, width, num_channels = input_shape
+    faces, labels = [], []
+    for key in keys:
+        image_path = os.path.join(imdb_images_path, key)
+        if num_channels == 1:
+            face = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        else:
+            face = cv2.imread(image_path)
+        if face is None:
+            continue
+        face = cv2.resize(face, (width, height))
+        if num_channels == 1:
+            face = face[:, :, np.newaxis]
+        else:
+            face = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
+        faces.append(face)
+        labels.append(int(ground_truth_data[key]))
+    return preprocess_input(np.array(faces)), np.array(labels)
+
+
+def load_faces(dataset_name, dataset_path, input_shape, num_calibration,
+               num_evaluation):
+    """Returns calibration faces from the training split and evaluation
+    faces with their label args from the validation split."""
+    data_loader = DataManager(dataset_name, dataset_path, input_shape[:2])
+    if dataset_name == 'imdb':
+        ground_truth_data = data_loader.get_data()
+        train_keys, val_keys = split_imdb_data(ground_truth_data,
+                                               validation_split)
+        calibration_faces = load_imdb_faces(
+            train_keys[:num_calibration], ground_truth_data, input_shape)[0]
+        evaluation_faces, evaluation_labels = load_imdb_faces(
+            val_keys[:num_evaluation], ground_truth_data, input_shape)
+        return calibration_faces, evaluation_faces, evaluation_labels
+
+    faces, labels = data_loader.get_data()
+    faces = preprocess_input(faces)
+    if faces.shape[-1] != input_shape[-1]:
+        faces = np.repeat(faces, input_shape[-1], axis=-1)
+    train_data, val_data = split_data(faces, labels, validation_split)
+    return (train_data[0][:num_calibration], val_data[0][:num_evaluation],
+            np.argmax(val_data[1][:num_evaluation], axis=1))
+
+
+def convert(model, variant, calibration_faces):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if variant == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == 'int8':
+        def representative_dataset():
+            for face in calibration_faces:
+                yield [face[np.newaxis].astype(np.float32)]
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    return converter.convert()
+
+
+def tflite_predict(interpreter, faces):
+    """Runs `faces` one at a time, quantizing inputs and dequantizing
+    outputs of int8 models. Returns the predictions and the latency of
+    every invoke in milliseconds."""
+    input_details = interpreter.get_input_details()[0]
+    output_details = interpreter.get_output_details()[0]
+    input_scale, input_zero_point = input_details['quantization']
+    output_scale, output_zero_point = output_details['quantization']
+    predictions, latencies = [], []
+    for face in faces:
+        face = face[np.newaxis]
+        if input_details['dtype'] == np.int8:
+            face = np.round(face / input_scale + input_zero_point)
+            face = np.clip(face, -128, 127)
+        interpreter.set_tensor(input_details['index'],
+                               face.astype(input_details['dtype']))
+        start_time = time.perf_counter()
+        interpreter.invoke()
+        latencies.append(time.perf_counter() - start_time)
+        prediction = interpreter.get_tensor(output_details['index'])[0]
+        if output_details['dtype'] == np.int8:
+            prediction = (prediction.astype(np.float32) -
+                          output_zero_point) * output_scale
+        predictions.append(prediction)
+    return np.array(predictions), np.array(latencies) * 1000
+
+
+def keras_predict(model, faces):
+    predictions, latencies = [], []
+    for face in faces:
+        start_time = time.perf_counter()
+        prediction = model(face[np.newaxis], training=False)
+        predictions.append(np.asarray(prediction)[0])
+        latencies.append(time.perf_counter() - start_time)
+    return np.array(predictions), np.array(latencies) * 1000
+
+
+def summarize(name, size, predictions, latencies, reference_predictions,
+              labels):
+    summary = {'variant': name, 'size_bytes': size,
+               'latency_p50_ms': float(np.percentile(latencies, 50)),
+               'latency_p95_ms': float(np.percentile(latencies, 95)),
+               'agreement': float(np.mean(
+                   np.argmax(predictions, axis=1) ==
+                   np.argmax(reference_predictions, axis=1)))}
+    if labels is not None:
+        summary['accuracy'] = float(np.mean(
+            np.argmax(predictions, axis=1) == labels))
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('model', help='hdf5 file or models.cnn architecture')
+    parser.add_argument('--weights', help='weights for an architecture')
+    parser.add_argument('--input-shape', type=int, nargs=3,
+                        default=[64, 64, 1])
+    parser.add_argument('--num-classes', type=int, default=7)
+    parser.add_argument('--dataset', choices=['fer2013', 'imdb', 'KDEF'])
+    parser.add_argument('--dataset-path')
+    parser.add_argument('--num-calibration', type=int, default=200)
+    parser.add_argument('--num-evaluation', type=int, default=1000)
+    parser.add_argument('--output-dir', default='../trained_models/tflite')
+    args = parser.parse_args()
+
+    model = build_model(args)
+    input_shape = model.input_shape[1:]
+    model_name = os.path.splitext(os.path.basename(args.model))[0]
+
+    labels = None
+    if args.dataset is not None and os.path.exists(
+            args.dataset_path or DataManager(args.dataset).dataset_path):
+        calibration_faces, evaluation_faces, labels = load_faces(
+            args.dataset, args.dataset_path, input_shape,
+            args.num_calibration, args.num_evaluation)
+    else:
+        print('No dataset found, calibrating on random inputs and reporting '
+              'agreement with Keras only')
+        calibration_faces = np.random.uniform(
+            -1, 1, (args.num_calibration,) + input_shape).astype(np.float32)
+        evaluation_faces = np.random.uniform(
+            -1, 1, (args.num_evaluation,) + input_shape).astype(np.float32)
+
+    reference_predictions, latencies = keras_predict(model, evaluation_faces)
+    keras_size = os.path.getsize(args.model) if os.path.exists(
+        args.model) else 0
+    report = [summarize('keras', keras_size, reference_predictions, latencies,
+                        reference_predictions, labels)]
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+    for variant in variants:
+        tflite_model = convert(model, variant, calibration_faces)
+        output_path = os.path.join(args.output_dir, '%s_%s.tflite' % (
+            model_name, variant))
+        with open(output_path, 'wb') as output_file:
+            output_file.write(tflite_model)
+        interpreter = tf.lite.Interpreter(model_content=tflite_model)
+        interpreter.allocate_tensors()
+        predictions, latencies = tflite_predict(interpreter, evaluation_faces)
+        report.append(summarize(variant, len(tflite_model), predictions,
+                                latencies, reference_predictions, labels))
+        print('Wrote %s' % output_path)
+
+    print('%-8s %10s %8s %8s %9s %9s %9s' % (
+        'variant', 'size (KB)', 'p50 ms', 'p95 ms', 'agreement', 'accuracy',
+        'delta'))
+    for summary in report:
+        accuracy, delta = '', ''
+        if 'accuracy' in summary:
+            accuracy = '%.4f' % summary['accuracy']
+            delta = '%+.4f' % (summary['accuracy'] - report[0]['accuracy'])
+        print('%-8s %10.1f %8.3f %8.3f %9.4f %9s %9s' % (
+            summary['variant'], summary['size_bytes'] / 1024.,
+            summary['latency_p50_ms'], summary['latency_p95_ms'],
+            summary['agreement'], accuracy, delta))
+
+    report_path = os.path.join(args.output_dir, model_name + '_report.json')
+    with open(report_path, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+    print('Report written to %s' % report_path)
@@ -8,10 +8,8 @@ from utils.datasets import get_labels
 from utils.inference import detect_faces
 from utils.inference import draw_text
 from utils.inference import draw_bounding_box
-from utils.inference import apply_offsets
 from utils.inference import load_detection_model
-from utils.inference import load_image
-from utils.preprocessor import preprocess_input
+from utils.preprocessor import preprocess_faces
 
 # parameters for loading data and images
 image_path = sys.argv[1]
@@ -38,45 +36,37 @@ emotion_target_size = emotion_classifier.input_shape[1:3]
 gender_target_size = gender_classifier.input_shape[1:3]
 
 # loading images
-rgb_image = load_image(image_path, grayscale=False)
-gray_image = load_image(image_path, grayscale=True)
-gray_image = np.squeeze(gray_image)
-gray_image = gray_image.astype('uint8')
+bgr_image = cv2.imread(image_path)
+gray_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
 
 faces = detect_faces(face_detection, gray_image)
-for face_coordinates in faces:
-    x1, x2, y1, y2 = apply_offsets(face_coordinates, gender_offsets)
-    rgb_face = rgb_image[y1:y2, x1:x2]
+# gender offsets enclose the emotion offsets, so every face with an
+# emotion crop also has a gender crop
+gray_faces, face_args = preprocess_faces(gray_image, faces, emotion_offsets,
+                                         emotion_target_size,
+                                         grayscale=True, v2=True)
+faces = [faces[face_arg] for face_arg in face_args]
+rgb_faces, face_args = preprocess_faces(bgr_image, faces, gender_offsets,
+                                        gender_target_size, v2=False)
+if len(faces) > 0:
+    emotion_predictions = emotion_classifier.predict(gray_faces)
+    gender_predictions = gender_classifier.predict(rgb_faces)
 
-    x1, x2, y1, y2 = apply_offsets(face_coordinates, emotion_offsets)
-    gray_face = gray_image[y1:y2, x1:x2]
-
-    try:
-        rgb_face = cv2.resize(rgb_face, (gender_target_size))
-        gray_face = cv2.resize(gray_face, (emotion_target_size))
-    except:
-        continue
-
-    rgb_face = preprocess_input(rgb_face, False)
-    rgb_face = np.expand_dims(rgb_face, 0)
-    gender_prediction = gender_classifier.predict(rgb_face)
-    gender_label_arg = np.argmax(gender_prediction)
+for face_arg, face_coordinates in enumerate(faces):
+    gender_label_arg = np.argmax(gender_predictions[face_arg])
     gender_text = gender_labels[gender_label_arg]
 
-    gray_face = preprocess_input(gray_face, True)
-    gray_face = np.expand_dims(gray_face, 0)
-    gray_face = np.expand_dims(gray_face, -1)
-    emotion_label_arg = np.argmax(emotion_classifier.predict(gray_face))
+    emotion_label_arg = np.argmax(emotion_predictions[face_arg])
     emotion_text = emotion_labels[emotion_label_arg]
 
+    # colors are BGR, boxes are drawn straight onto the loaded image
     if gender_text == gender_labels[0]:
-        color = (0, 0, 255)
-    else:
         color = (255, 0, 0)
+    else:
+        color = (0, 0, 255)
 
-    draw_bounding_box(face_coordinates, rgb_image, color)
-    draw_text(face_coordinates, rgb_image, gender_text, color, 0, -20, 1, 2)
-    draw_text(face_coordinates, rgb_image, emotion_text, color, 0, -50, 1, 2)
+    draw_bounding_box(face_coordinates, bgr_image, color)
+    draw_text(face_coordinates, bgr_image, gender_text, color, 0, -20, 1, 2)
+    draw_text(face_coordinates, bgr_image, emotion_text, color, 0, -50, 1, 2)
 
-bgr_image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
 cv2.imwrite('../images/predicted_test_image.png', bgr_image)
@@ -204,11 +204,8 @@ def tiny_XCEPTION(input_shape, num_classes, l2_regularization=0.01):
     return model
 
 
-def mini_XCEPTION(input_shape, num_classes, l2_regularization=0.01):
-    regularization = l2(l2_regularization)
-
+def _mini_XCEPTION_trunk(img_input, regularization):
     # base
-    img_input = Input(input_shape)
     x = Conv2D(8, (3, 3), strides=(1, 1), kernel_regularizer=regularization,
                use_bias=False)(img_input)
     x = BatchNormalization()(x)
@@ -290,6 +287,15 @@ def mini_XCEPTION(input_shape, num_classes, l2_regularization=0.01):
     x = MaxPooling2D((3, 3), strides=(2, 2), padding='same')(x)
     x = layers.add([x, residual])
 
+    return x
+
+
+def mini_XCEPTION(input_shape, num_classes, l2_regularization=0.01):
+    regularization = l2(l2_regularization)
+
+    img_input = Input(input_shape)
+    x = _mini_XCEPTION_trunk(img_input, regularization)
+
     x = Conv2D(num_classes, (3, 3),
                # kernel_regularizer=regularization,
                padding='same')(x)
@@ -300,6 +306,27 @@ def mini_XCEPTION(input_shape, num_classes, l2_regularization=0.01):
     return model
 
 
+def multi_task_XCEPTION(input_shape, num_emotions, num_genders,
+                        l2_regularization=0.01):
+    """mini_XCEPTION trunk shared by an emotion head and a gender head, so
+    both predictions come out of a single forward pass."""
+    regularization = l2(l2_regularization)
+
+    img_input = Input(input_shape)
+    x = _mini_XCEPTION_trunk(img_input, regularization)
+
+    emotion = Conv2D(num_emotions, (3, 3), padding='same')(x)
+    emotion = GlobalAveragePooling2D()(emotion)
+    emotion = Activation('softmax', name='emotion_predictions')(emotion)
+
+    gender = Conv2D(num_genders, (3, 3), padding='same')(x)
+    gender = GlobalAveragePooling2D()(gender)
+    gender = Activation('softmax', name='gender_predictions')(gender)
+
+    model = Model(img_input, [emotion, gender])
+    return model
+
+
 def big_XCEPTION(input_shape, num_classes):
     img_input = Input(input_shape)
     x = Conv2D(32, (3, 3), strides=(2, 2), use_bias=False)(img_input)
@@ -0,0 +1,123 @@
+"""
+File: train_multi_task_classifier.py
+Description: Train one model for emotion and gender classification, with a
+    shared mini_XCEPTION trunk and one head per task. Every batch holds
+    fer2013 faces, labelled with an emotion only, and imdb faces, labelled
+    with a gender only. The missing label of each face is masked out of its
+    head's loss with a zero sample weight.
+"""
+
+from keras.callbacks import CSVLogger, ModelCheckpoint, EarlyStopping
+from keras.callbacks import ReduceLROnPlateau
+from keras.preprocessing.image import ImageDataGenerator
+import numpy as np
+
+from models.cnn import multi_task_XCEPTION
+from utils.data_augmentation import ImageGenerator
+from utils.datasets import DataManager
+from utils.datasets import split_data
+from utils.datasets import split_imdb_data
+from utils.preprocessor import preprocess_input
+
+# parameters
+batch_size = 32
+num_epochs = 10000
+input_shape = (64, 64, 1)
+validation_split = .2
+verbose = 1
+num_emotions = 7
+num_genders = 2
+patience = 50
+images_path = '../datasets/imdb_crop/'
+base_path = '../trained_models/multi_task_models/'
+log_file_path = base_path + 'multi_task_training.log'
+trained_models_path = base_path + 'multi_task_XCEPTION'
+
+
+def multi_task_flow(emotion_flow, gender_flow):
+    """Joins an emotion batch and a gender batch into one batch with targets
+    for both heads. A face without a label for a head gets an all-zero
+    target and a zero sample weight for that head."""
+    while True:
+        emotion_faces, emotions = next(emotion_flow)
+        gender_inputs, gender_targets = next(gender_flow)
+        gender_faces = gender_inputs['input_1']
+        genders = gender_targets['predictions']
+        num_emotion_faces, num_gender_faces = len(emotion_faces), len(genders)
+
+        faces = np.concatenate([emotion_faces, gender_faces])
+        # targets and sample weights follow the model outputs:
+        # emotion_predictions, then gender_predictions
+        targets = [np.concatenate([emotions, np.zeros((num_gender_faces,
+                                                       num_emotions))]),
+                   np.concatenate([np.zeros((num_emotion_faces, num_genders)),
+                                   genders])]
+        emotion_mask = np.concatenate([np.ones(num_emotion_faces),
+                                       np.zeros(num_gender_faces)])
+        yield faces, targets, [emotion_mask, 1 - emotion_mask]
+
+
+# emotion data: fer2013 faces in memory
+data_generator = ImageDataGenerator(
+                        featurewise_center=False,
+                        featurewise_std_normalization=False,
+                        rotation_range=10,
+                        width_shift_range=0.1,
+                        height_shift_range=0.1,
+                        zoom_range=.1,
+                        horizontal_flip=True)
+emotion_loader = DataManager('fer2013', image_size=input_shape[:2])
+faces, emotions = emotion_loader.get_data()
+faces = preprocess_input(faces)
+train_data, val_data = split_data(faces, emotions, validation_split)
+train_faces, train_emotions = train_data
+val_faces, val_emotions = val_data
+
+# gender data: imdb faces read from disk batch by batch
+gender_loader = DataManager('imdb')
+ground_truth_data = gender_loader.get_data()
+train_keys, val_keys = split_imdb_data(ground_truth_data, validation_split)
+image_generator = ImageGenerator(ground_truth_data, batch_size,
+                                 input_shape[:2],
+                                 train_keys, val_keys, None,
+                                 path_prefix=images_path,
+                                 vertical_flip_probability=0,
+                                 grayscale=True)
+print('Number of training samples:', len(train_faces) + len(train_keys))
+print('Number of validation samples:', len(val_faces) + len(val_keys))
+
+train_flow = multi_task_flow(
+    data_generator.flow(train_faces, train_emotions, batch_size),
+    image_generator.flow(mode='train'))
+val_flow = multi_task_flow(
+    ImageDataGenerator().flow(val_faces, val_emotions, batch_size),
+    image_generator.flow('val'))
+# an epoch walks the larger of the two datasets once
+steps_per_epoch = int(max(len(train_faces), len(train_keys)) / batch_size)
+validation_steps = int(max(len(val_faces), len(val_keys)) / batch_size)
+
+# model parameters/compilation
+model = multi_task_XCEPTION(input_shape, num_emotions, num_genders)
+model.compile(optimizer='adam',
+              loss=['categorical_crossentropy', 'categorical_crossentropy'],
+              weighted_metrics={'emotion_predictions': ['accuracy'],
+                                'gender_predictions': ['accuracy']})
+model.summary()
+
+# callbacks
+csv_logger = CSVLogger(log_file_path, append=False)
+early_stop = EarlyStopping('val_loss', patience=patience)
+reduce_lr = ReduceLROnPlateau('val_loss', factor=0.1,
+                              patience=int(patience/4), verbose=1)
+model_names = trained_models_path + '.{epoch:02d}-{val_loss:.2f}.hdf5'
+model_checkpoint = ModelCheckpoint(model_names, 'val_loss', verbose=1,
+                                   save_best_only=True)
+callbacks = [model_checkpoint, csv_logger, early_stop, reduce_lr]
+
+# training model
+model.fit_generator(train_flow,
+                    steps_per_epoch=steps_per_epoch,
+                    epochs=num_epochs, verbose=verbose,
+                    callbacks=callbacks,
+                    validation_data=val_flow,
+                    validation_steps=validation_steps)
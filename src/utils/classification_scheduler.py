@@ -0,0 +1,109 @@
+import time
+
+from .smoothing import ProbabilitySmoother
+
+
+class ClassificationScheduler(object):
+    """Decides, frame by frame, which face tracks are classified again and
+    serves the last smoothed result for the others.
+
+    Classification may use `cpu_budget` of every frame period at
+    `target_fps`. That time is credited every frame and spent at the
+    measured per-face latency, so the refresh rate adapts to how fast the
+    model actually runs. The stalest tracks are refreshed first, no track
+    more often than `max_track_rate` times a second, and new tracks are
+    classified immediately. Results are kept by a `ProbabilitySmoother`, an
+    exponential moving average with weight `alpha` on every new prediction,
+    for up to `max_tracks` tracks. Every `report_every` seconds the display
+    rate and the inference rate are printed.
+    """
+    def __init__(self, target_fps=30, cpu_budget=0.5, max_track_rate=10.0,
+                 alpha=0.5, report_every=2.0, max_tracks=32):
+        self.frame_budget = cpu_budget / float(target_fps)
+        self.max_credit = 2 * self.frame_budget
+        self.min_track_interval = 1.0 / max_track_rate
+        self.alpha = alpha
+        self.max_tracks = max_tracks
+        self.report_every = report_every
+        self.credit = 0.0
+        self.face_latency = None
+        # created on the first update, once the prediction size is known
+        self.smoother = None
+        self.last_classified = {}
+        self.num_frames = 0
+        self.num_classified = 0
+        self.last_report = time.monotonic()
+
+    def select(self, track_ids):
+        """Returns the args of the faces in `track_ids` to classify on this
+        frame."""
+        now = time.monotonic()
+        self.num_frames = self.num_frames + 1
+        self._report(now, len(track_ids))
+        for track_id in list(self.last_classified):
+            if track_id not in track_ids:
+                del self.last_classified[track_id]
+        if self.smoother is not None:
+            self.smoother.retain(track_ids)
+
+        self.credit = min(self.credit + self.frame_budget, self.max_credit)
+        face_latency = self.face_latency or 0.0
+        new_args = [face_arg for face_arg, track_id in enumerate(track_ids)
+                    if track_id not in self.last_classified]
+        stale_args = sorted(
+            [face_arg for face_arg, track_id in enumerate(track_ids)
+             if track_id in self.last_classified and
+             now - self.last_classified[track_id] >= self.min_track_interval],
+            key=lambda face_arg: self.last_classified[track_ids[face_arg]])
+
+        selected_args = list(new_args)
+        self.credit = self.credit - face_latency * len(new_args)
+        for face_arg in stale_args:
+            if self.credit < face_latency or self.credit <= 0:
+                break
+            selected_args.append(face_arg)
+            self.credit = self.credit - face_latency
+        return selected_args
+
+    def update(self, track_ids, predictions, elapsed_time):
+        """Records the `predictions` made for `track_ids` in `elapsed_time`
+        seconds."""
+        if len(track_ids) == 0:
+            return
+        now = time.monotonic()
+        face_latency = elapsed_time / len(track_ids)
+        if self.face_latency is None:
+            self.face_latency = face_latency
+        else:
+            self.face_latency += 0.2 * (face_latency - self.face_latency)
+        if self.smoother is None:
+            self.smoother = ProbabilitySmoother(len(predictions[0]),
+                                                self.alpha, self.max_tracks)
+        # only some of the visible tracks are classified on a frame, the
+        # others keep their rows until `select` sees them leave
+        self.smoother.update(track_ids, predictions, release=False)
+        for track_id in track_ids:
+            self.last_classified[track_id] = now
+        self.num_classified = self.num_classified + len(track_ids)
+
+    def get(self, track_ids):
+        """Returns the smoothed result of every track, None for tracks that
+        were never classified."""
+        if self.smoother is None:
+            return [None] * len(track_ids)
+        return self.smoother.get(track_ids)
+
+    def _report(self, now, num_tracks):
+        elapsed_time = now - self.last_report
+        if self.report_every is None or elapsed_time < self.report_every:
+            return
+        display_rate = self.num_frames / elapsed_time
+        inference_rate = self.num_classified / elapsed_time
+        print('display %.1f fps | inference %.1f faces/s | %d tracks, %.1f '
+              'refreshes/s each | %.1f ms/face' % (
+                  display_rate, inference_rate, num_tracks,
+                  inference_rate / max(num_tracks, 1),
+                  1000 * (self.face_latency or 0.0)))
+        self.num_frames = 0
+        self.num_classified = 0
+        self.last_report = now
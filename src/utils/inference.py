@@ -14,6 +14,39 @@ def load_detection_model(model_path):
 def detect_faces(detection_model, gray_image_array):
     return detection_model.detectMultiScale(gray_image_array, 1.3, 5)
 
+def get_detection_scale(detection_model, gray_image_array, min_face_size,
+                        min_width=320):
+    """Largest downscale factor that keeps a `min_face_size` face at twice
+    the cascade's base window (below that, recall with the 1.3 scale step
+    drops quickly) without shrinking the image below `min_width` pixels."""
+    window_width, window_height = detection_model.getOriginalWindowSize()
+    face_scale = min_face_size / float(2 * max(window_width, window_height))
+    width_scale = gray_image_array.shape[1] / float(min_width)
+    return max(1.0, min(face_scale, width_scale))
+
+def detect_faces_downscaled(detection_model, gray_image_array, min_face_size=80):
+    """Runs the cascade on a copy of the image shrunk as far as faces of
+    `min_face_size` pixels allow, then maps the boxes back to full-resolution
+    coordinates. Faces smaller than `min_face_size` may be missed."""
+    scale = get_detection_scale(detection_model, gray_image_array, min_face_size)
+    if scale == 1.0:
+        return detect_faces(detection_model, gray_image_array)
+    height, width = gray_image_array.shape[:2]
+    small_size = (int(round(width / scale)), int(round(height / scale)))
+    small_gray_image = cv2.resize(gray_image_array, small_size,
+                                  interpolation=cv2.INTER_AREA)
+    faces = detect_faces(detection_model, small_gray_image)
+    if len(faces) == 0:
+        return faces
+    return np.round(np.asarray(faces) * scale).astype(int)
+
+def predict_emotion_gender(multi_task_model, gray_faces):
+    """Runs a `multi_task_XCEPTION` model once on a batch of preprocessed
+    gray faces and returns the emotion and the gender probabilities."""
+    emotion_predictions, gender_predictions = multi_task_model.predict(
+        gray_faces)
+    return emotion_predictions, gender_predictions
+
 def draw_bounding_box(face_coordinates, image_array, color):
     x, y, w, h = face_coordinates
     cv2.rectangle(image_array, (x, y), (x + w, y + h), color, 2)
@@ -0,0 +1,97 @@
+import threading
+import time
+import traceback
+
+import numpy as np
+
+
+class ModelUnavailable(Exception):
+    """Raised by `ModelRegistry.get` when a model could not be loaded."""
+
+
+class ModelRegistry(object):
+    """Process-wide store of loaded models.
+
+    A model is registered with a `loader` that builds it and an optional
+    `warmup` function that runs it once on a dummy batch. `get` loads each
+    model once and hands the same object to every caller afterwards.
+    `start_warmup` loads and warms every registered model in a background
+    thread; `status` reports when that is done, for readiness checks.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.warmup_thread = None
+        self.warmup_done = threading.Event()
+
+    def register(self, name, loader, warmup=None):
+        with self.lock:
+            if name not in self.entries:
+                self.entries[name] = {'loader': loader, 'warmup': warmup,
+                                      'lock': threading.Lock(),
+                                      'model': None, 'load_ms': None,
+                                      'warmup_ms': None, 'error': None}
+
+    def get(self, name):
+        """Returns the model registered as `name`, loading it on first
+        use. Raises `ModelUnavailable` when loading fails."""
+        entry = self.entries[name]
+        if entry['model'] is None:
+            with entry['lock']:
+                if entry['model'] is None:
+                    start_time = time.perf_counter()
+                    try:
+                        entry['model'] = entry['loader']()
+                    except Exception as error:
+                        entry['error'] = str(error)
+                        raise ModelUnavailable(
+                            'Model {0} could not be loaded: {1}'.format(
+                                name, error))
+                    entry['error'] = None
+                    entry['load_ms'] = (time.perf_counter() -
+                                        start_time) * 1000
+        return entry['model']
+
+    def warmup(self):
+        """Loads every registered model and runs its warmup function."""
+        for name, entry in list(self.entries.items()):
+            try:
+                model = self.get(name)
+                if entry['warmup'] is not None:
+                    start_time = time.perf_counter()
+                    entry['warmup'](model)
+                    entry['warmup_ms'] = (time.perf_counter() -
+                                          start_time) * 1000
+            except Exception as error:
+                entry['error'] = str(error)
+                traceback.print_exc()
+        self.warmup_done.set()
+
+    def start_warmup(self):
+        with self.lock:
+            if self.warmup_thread is None:
+                self.warmup_thread = threading.Thread(
+                    target=self.warmup, daemon=True, name='model-warmup')
+                self.warmup_thread.start()
+
+    def is_ready(self):
+        return self.warmup_done.is_set() and not any(
+            entry['error'] for entry in self.entries.values())
+
+    def status(self):
+        return {'ready': self.is_ready(),
+                'warmup_done': self.warmup_done.is_set(),
+                'models': {name: {'loaded': entry['model'] is not None,
+                                  'load_ms': entry['load_ms'],
+                                  'warmup_ms': entry['warmup_ms'],
+                                  'error': entry['error']}
+                           for name, entry in self.entries.items()}}
+
+
+def warmup_keras_model(model):
+    """Runs `model` on a batch of zeros shaped like its input."""
+    dummy_batch = np.zeros((1,) + tuple(model.input_shape[1:]), np.float32)
+    model.predict(dummy_batch)
+
+
+registry = ModelRegistry()
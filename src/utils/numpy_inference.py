@@ -0,0 +1,275 @@
+import json
+
+import h5py
+import numpy as np
+
+
+def _same_padding(size, kernel_size, stride):
+    output_size = -(-size // stride)
+    total_padding = max((output_size - 1) * stride + kernel_size - size, 0)
+    return output_size, (total_padding // 2, total_padding - total_padding // 2)
+
+
+def _pad(x, kernel_size, strides, padding, value=0.0):
+    """Pads the (batch, height, width, channels) `x` like TensorFlow does
+    and returns it with the output height and width."""
+    if padding == 'valid':
+        output_size = [(x.shape[axis + 1] - kernel_size[axis]) // strides[axis] + 1
+                       for axis in (0, 1)]
+        return x, output_size
+    (output_height, height_padding), (output_width, width_padding) = [
+        _same_padding(x.shape[axis + 1], kernel_size[axis], strides[axis])
+        for axis in (0, 1)]
+    if height_padding != (0, 0) or width_padding != (0, 0):
+        x = np.pad(x, ((0, 0), height_padding, width_padding, (0, 0)),
+                   constant_values=value)
+    return x, (output_height, output_width)
+
+
+def _windows(x, kernel_size, strides, output_size):
+    """Yields, for every kernel offset, the strided view of `x` that the
+    offset sees over all output positions."""
+    output_height, output_width = output_size
+    stride_y, stride_x = strides
+    for kernel_y in range(kernel_size[0]):
+        for kernel_x in range(kernel_size[1]):
+            yield kernel_y, kernel_x, x[
+                :, kernel_y:kernel_y + (output_height - 1) * stride_y + 1:stride_y,
+                kernel_x:kernel_x + (output_width - 1) * stride_x + 1:stride_x]
+
+
+def conv2d(x, kernel, strides, padding):
+    kernel_size = kernel.shape[:2]
+    x, output_size = _pad(x, kernel_size, strides, padding)
+    output = None
+    for kernel_y, kernel_x, window in _windows(x, kernel_size, strides,
+                                               output_size):
+        product = np.matmul(window, kernel[kernel_y, kernel_x])
+        output = product if output is None else output + product
+    return output
+
+
+def depthwise_conv2d(x, depthwise_kernel, strides, padding):
+    kernel_size = depthwise_kernel.shape[:2]
+    depth_multiplier = depthwise_kernel.shape[3]
+    x, output_size = _pad(x, kernel_size, strides, padding)
+    output = None
+    for kernel_y, kernel_x, window in _windows(x, kernel_size, strides,
+                                               output_size):
+        if depth_multiplier == 1:
+            product = window * depthwise_kernel[kernel_y, kernel_x, :, 0]
+        else:
+            product = window[..., np.newaxis] * depthwise_kernel[kernel_y, kernel_x]
+        output = product if output is None else output + product
+    if depth_multiplier != 1:
+        output = output.reshape(output.shape[:3] + (-1,))
+    return output
+
+
+def max_pool2d(x, pool_size, strides, padding):
+    x, output_size = _pad(x, pool_size, strides, padding, -np.inf)
+    output = None
+    for _, _, window in _windows(x, pool_size, strides, output_size):
+        output = window.copy() if output is None else np.maximum(output, window)
+    return output
+
+
+def average_pool2d(x, pool_size, strides, padding):
+    # like Keras, padded positions are left out of the average
+    counts = np.ones((1,) + x.shape[1:3] + (1,), np.float32)
+    x, output_size = _pad(x, pool_size, strides, padding)
+    counts, _ = _pad(counts, pool_size, strides, padding)
+    output, output_counts = None, None
+    for (_, _, window), (_, _, count_window) in zip(
+            _windows(x, pool_size, strides, output_size),
+            _windows(counts, pool_size, strides, output_size)):
+        if output is None:
+            output, output_counts = window.copy(), count_window.copy()
+        else:
+            output, output_counts = output + window, output_counts + count_window
+    return output / output_counts
+
+
+def relu(x):
+    return np.maximum(x, 0)
+
+
+def softmax(x):
+    x = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return x / np.sum(x, axis=-1, keepdims=True)
+
+
+activations = {
+    'linear': lambda x: x,
+    'relu': relu,
+    'softmax': softmax,
+}
+
+
+def _activation(name):
+    if name not in activations:
+        raise ValueError('Unsupported activation: {0}'.format(name))
+    return activations[name]
+
+
+def _layer_weights(weights_group, layer_name):
+    """Returns the weights of a layer by their short name, e.g. `kernel` or
+    `moving_mean`, for both Keras 2 and Keras 3 hdf5 files."""
+    if layer_name not in weights_group:
+        return {}
+    layer_group = weights_group[layer_name]
+    weights = {}
+    for weight_name in layer_group.attrs.get('weight_names', []):
+        if isinstance(weight_name, bytes):
+            weight_name = weight_name.decode('utf8')
+        short_name = weight_name.split('/')[-1].split(':')[0]
+        weights[short_name] = np.asarray(layer_group[weight_name], np.float32)
+    return weights
+
+
+def _build_layer(class_name, config, weights):
+    """Returns a function computing the layer from its list of inputs."""
+    if class_name in ('InputLayer', 'Dropout'):
+        return lambda inputs: inputs[0]
+    if class_name == 'Add':
+        return lambda inputs: sum(inputs[1:], inputs[0])
+    if class_name == 'Flatten':
+        return lambda inputs: inputs[0].reshape(len(inputs[0]), -1)
+    if class_name == 'GlobalAveragePooling2D':
+        return lambda inputs: np.mean(inputs[0], axis=(1, 2))
+    if class_name == 'Activation':
+        activation = _activation(config['activation'])
+        return lambda inputs: activation(inputs[0])
+
+    if class_name == 'BatchNormalization':
+        # folded into a single multiply-add at load time
+        scale = 1.0 / np.sqrt(weights['moving_variance'] + config['epsilon'])
+        scale = scale * weights.get('gamma', 1.0)
+        shift = weights.get('beta', 0.0) - weights['moving_mean'] * scale
+        scale, shift = scale.astype(np.float32), shift.astype(np.float32)
+        return lambda inputs: inputs[0] * scale + shift
+
+    if class_name in ('MaxPooling2D', 'AveragePooling2D'):
+        pool_size = tuple(config['pool_size'])
+        strides = tuple(config.get('strides') or pool_size)
+        padding = config['padding']
+        pool = max_pool2d if class_name == 'MaxPooling2D' else average_pool2d
+        return lambda inputs: pool(inputs[0], pool_size, strides, padding)
+
+    if class_name in ('Conv2D', 'Convolution2D', 'SeparableConv2D'):
+        if tuple(config.get('dilation_rate', (1, 1))) != (1, 1):
+            raise ValueError('Dilated convolutions are not supported')
+        strides = tuple(config['strides'])
+        padding = config['padding']
+        bias = weights.get('bias')
+        activation = _activation(config.get('activation', 'linear'))
+        if class_name == 'SeparableConv2D':
+            depthwise_kernel = weights['depthwise_kernel']
+            pointwise_kernel = weights['pointwise_kernel'][0, 0]
+
+            def convolve(x):
+                x = depthwise_conv2d(x, depthwise_kernel, strides, padding)
+                return np.matmul(x, pointwise_kernel)
+        else:
+            kernel = weights['kernel']
+
+            def convolve(x):
+                return conv2d(x, kernel, strides, padding)
+
+        def layer(inputs):
+            x = convolve(inputs[0])
+            if bias is not None:
+                x = x + bias
+            return activation(x)
+        return layer
+
+    raise ValueError('Unsupported layer: {0}'.format(class_name))
+
+
+def _inbound_names(layer):
+    """Names of the layers feeding `layer` in a functional model config,
+    written either by Keras 2 or by Keras 3."""
+    inbound_nodes = layer.get('inbound_nodes') or []
+    if len(inbound_nodes) == 0:
+        return []
+    node = inbound_nodes[0]
+    if isinstance(node, list):
+        return [inbound[0] for inbound in node]
+    names = []
+    for argument in node['args']:
+        for tensor in (argument if isinstance(argument, list) else [argument]):
+            names.append(tensor['config']['keras_history'][0])
+    return names
+
+
+def _input_shape(layer):
+    config = layer['config']
+    shape = config.get('batch_input_shape') or config.get('batch_shape')
+    return None if shape is None else tuple(shape)
+
+
+class NumpyModel(object):
+    """A Keras model loaded from an hdf5 file and run with NumPy, so
+    classifying faces needs neither TensorFlow nor Keras to be imported.
+
+    Supports the layers used in `models/cnn.py`: Conv2D, SeparableConv2D,
+    BatchNormalization, ReLU and softmax activations, max and average
+    pooling, residual adds, global average pooling, Flatten and Dropout.
+    `predict` takes a float32 batch in the layout the Keras model expects
+    and returns its output, or a list of outputs for multi-output models.
+    """
+    def __init__(self, model_path):
+        with h5py.File(model_path, 'r') as model_file:
+            model_config = model_file.attrs['model_config']
+            if isinstance(model_config, bytes):
+                model_config = model_config.decode('utf8')
+            model_config = json.loads(model_config)
+            weights_group = model_file['model_weights']
+            self.layers = []
+            if model_config['class_name'] == 'Sequential':
+                self._load_sequential(model_config['config'], weights_group)
+            else:
+                self._load_functional(model_config['config'], weights_group)
+
+    def _load_sequential(self, config, weights_group):
+        layers = config if isinstance(config, list) else config['layers']
+        self.input_shape = _input_shape(layers[0])
+        previous_name = 'input'
+        for layer in layers:
+            name = layer['config']['name']
+            function = _build_layer(layer['class_name'], layer['config'],
+                                    _layer_weights(weights_group, name))
+            self.layers.append((name, function, [previous_name]))
+            previous_name = name
+        self.input_names = ['input']
+        self.output_names = [previous_name]
+
+    def _load_functional(self, config, weights_group):
+        self.input_shape = None
+        for layer in config['layers']:
+            name = layer['name'] if 'name' in layer else layer['config']['name']
+            if layer['class_name'] == 'InputLayer':
+                self.input_shape = _input_shape(layer)
+                continue
+            function = _build_layer(layer['class_name'], layer['config'],
+                                    _layer_weights(weights_group, name))
+            self.layers.append((name, function, _inbound_names(layer)))
+        input_layers = config['input_layers']
+        output_layers = config['output_layers']
+        # a single input or output may be stored as one [name, 0, 0] entry
+        if isinstance(input_layers[0], str):
+            input_layers = [input_layers]
+        if isinstance(output_layers[0], str):
+            output_layers = [output_layers]
+        self.input_names = [input_layer[0] for input_layer in input_layers]
+        self.output_names = [output_layer[0] for output_layer in output_layers]
+
+    def predict(self, faces):
+        tensors = {self.input_names[0]: np.asarray(faces, np.float32)}
+        for name, function, input_names in self.layers:
+            tensors[name] = function([tensors[input_name]
+                                      for input_name in input_names])
+        outputs = [tensors[name] for name in self.output_names]
+        if len(outputs) == 1:
+            return outputs[0]
+        return outputs
@@ -0,0 +1,161 @@
+from collections import deque
+import threading
+import time
+
+
+class FrameQueue(object):
+    """Bounded queue between two pipeline stages whose `put` never blocks.
+    When the consumer falls behind, the oldest waiting item is dropped, so
+    the next stage always works on the freshest frame."""
+    def __init__(self, maxsize=1):
+        self.items = deque(maxlen=maxsize)
+        self.condition = threading.Condition()
+        self.closed = False
+        self.num_dropped = 0
+
+    def put(self, item):
+        with self.condition:
+            if len(self.items) == self.items.maxlen:
+                self.num_dropped = self.num_dropped + 1
+            self.items.append(item)
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def get(self):
+        """Waits for the oldest waiting item, or returns None once the
+        queue is closed and empty."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.items or self.closed)
+            if not self.items:
+                return None
+            return self.items.popleft()
+
+
+class Pipeline(object):
+    """Runs a frame source and a chain of stages, each on its own thread,
+    connected by `FrameQueue`s of `maxsize` items.
+
+    `source` returns the next frame, or None when the stream ends. Every
+    stage is a `(name, function)` pair; the function takes the item of the
+    previous stage and returns the item for the next one, or None to drop
+    it. The last stage runs on the calling thread, since GUI calls such as
+    `cv2.imshow` must stay on the main thread; it returns False to stop.
+    An exception in the source or any stage stops the pipeline and is
+    raised again from `run`. Before `run` returns it waits up to
+    `join_timeout` seconds for every thread to finish, so the caller can
+    release the capture device once no thread is reading from it.
+
+    Stages never wait for the ones after them: a slow stage only makes the
+    stage before it drop stale items. Every `report_every` seconds the
+    frames per second of each stage and the items dropped in front of it
+    are printed.
+    """
+    def __init__(self, source, stages, maxsize=1, report_every=2.0,
+                 join_timeout=2.0):
+        self.source = source
+        self.stages = stages
+        self.maxsize = maxsize
+        self.report_every = report_every
+        self.join_timeout = join_timeout
+        self.threads = []
+        self.stopped = threading.Event()
+        self.names = ['capture'] + [name for name, function in stages]
+        self.counts = dict((name, 0) for name in self.names)
+        self.queues = [FrameQueue(maxsize) for stage in stages]
+        self.lock = threading.Lock()
+        self.error = None
+
+    def _count(self, name):
+        with self.lock:
+            self.counts[name] = self.counts[name] + 1
+
+    def _fail(self, error):
+        with self.lock:
+            if self.error is None:
+                self.error = error
+        self.stop()
+
+    def _capture(self):
+        output_queue = self.queues[0]
+        try:
+            while not self.stopped.is_set():
+                frame = self.source()
+                if frame is None:
+                    break
+                output_queue.put(frame)
+                self._count('capture')
+        except Exception as error:
+            self._fail(error)
+        finally:
+            output_queue.close()
+
+    def _run_stage(self, name, function, input_queue, output_queue):
+        try:
+            while True:
+                item = input_queue.get()
+                if item is None or self.stopped.is_set():
+                    break
+                item = function(item)
+                self._count(name)
+                if item is not None:
+                    output_queue.put(item)
+        except Exception as error:
+            self._fail(error)
+        finally:
+            output_queue.close()
+
+    def report(self, elapsed_time):
+        with self.lock:
+            counts = dict(self.counts)
+            for name in self.names:
+                self.counts[name] = 0
+        readout = ['%s %.1f fps' % (name, counts[name] / elapsed_time)
+                   for name in self.names]
+        dropped = ['%s %d' % (name, frame_queue.num_dropped)
+                   for name, frame_queue in zip(self.names[1:], self.queues)]
+        print(' | '.join(readout) + ' | dropped before ' + ', '.join(dropped))
+
+    def run(self):
+        self.threads = threads = [threading.Thread(target=self._capture, daemon=True,
+                                    name='pipeline-capture')]
+        for stage_arg, (name, function) in enumerate(self.stages[:-1]):
+            threads.append(threading.Thread(
+                target=self._run_stage, daemon=True, name='pipeline-' + name,
+                args=(name, function, self.queues[stage_arg],
+                      self.queues[stage_arg + 1])))
+        for thread in threads:
+            thread.start()
+
+        name, function = self.stages[-1]
+        last_report = time.monotonic()
+        try:
+            while True:
+                item = self.queues[-1].get()
+                if item is None or function(item) is False:
+                    break
+                self._count(name)
+                now = time.monotonic()
+                if now - last_report >= self.report_every:
+                    self.report(now - last_report)
+                    last_report = now
+        finally:
+            self.stop()
+            self.join()
+        if self.error is not None:
+            raise self.error
+
+    def join(self):
+        """Waits, at most `join_timeout` seconds in total, for the capture
+        and stage threads to finish."""
+        deadline = time.monotonic() + self.join_timeout
+        for thread in self.threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+
+    def stop(self):
+        self.stopped.set()
+        for frame_queue in self.queues:
+            frame_queue.close()
@@ -1,3 +1,4 @@
+import cv2
 import numpy as np
 import imageio
 from PIL import Image
@@ -12,6 +13,68 @@ def preprocess_input(x, v2=True):
     return x
 
 
+def crop_face(image_array, face_coordinates, offsets):
+    """Returns the face region enlarged by `offsets` and clipped to the
+    image, as a view into `image_array`."""
+    x, y, width, height = face_coordinates
+    x_off, y_off = offsets
+    height_limit, width_limit = image_array.shape[:2]
+    x1, x2 = max(0, x - x_off), min(width_limit, x + width + x_off)
+    y1, y2 = max(0, y - y_off), min(height_limit, y + height + y_off)
+    return image_array[y1:y2, x1:x2]
+
+
+def preprocess_faces(image_array, faces, offsets, target_size,
+                     grayscale=False, normalize=True, v2=True, out=None):
+    """Crops every face straight from the BGR frame, converts color on the
+    crop only, resizes it into one uint8 batch and normalizes the whole
+    batch in a single pass, like `preprocess_input`. A single-channel
+    `image_array` is taken as already gray and cropped without conversion.
+
+    `target_size` is (height, width). With `normalize` False the float32
+    batch keeps raw [0, 255] pixel values. `out` may be a float32 array of
+    at least (len(faces), height, width, channels) to reuse between calls.
+    Returns the batch and the indices of the faces it holds; faces whose
+    crop is empty are skipped.
+    """
+    height, width = target_size
+    num_channels = 1 if grayscale else 3
+    if image_array.ndim == 2:
+        color_code = None
+    elif grayscale:
+        color_code = cv2.COLOR_BGR2GRAY
+    else:
+        color_code = cv2.COLOR_BGR2RGB
+    pixels = np.empty((len(faces), height, width, num_channels), np.uint8)
+
+    face_args = []
+    for face_arg, face_coordinates in enumerate(faces):
+        face = crop_face(image_array, face_coordinates, offsets)
+        if face.size == 0:
+            continue
+        if color_code is not None:
+            face = cv2.cvtColor(face, color_code)
+        # resize writes straight into the batch buffer
+        resized_face = pixels[len(face_args)]
+        if grayscale:
+            resized_face = resized_face[:, :, 0]
+        cv2.resize(face, (width, height), dst=resized_face)
+        face_args.append(face_arg)
+
+    num_faces = len(face_args)
+    if out is None:
+        out = np.empty(pixels.shape, np.float32)
+    batch = out[:num_faces]
+    if normalize and v2:
+        np.multiply(pixels[:num_faces], 2.0 / 255.0, out=batch)
+        batch -= 1.0
+    elif normalize:
+        np.multiply(pixels[:num_faces], 1.0 / 255.0, out=batch)
+    else:
+        batch[...] = pixels[:num_faces]
+    return batch, face_args
+
+
 def _imread(image_name):
     return imageio.imread(image_name)
 
@@ -0,0 +1,65 @@
+import threading
+
+import numpy as np
+
+
+class ProbabilitySmoother(object):
+    """Exponential moving average of the class probability vector of every
+    face track.
+
+    Averages live in one preallocated (max_tracks, num_classes) array and
+    each track owns a row while it is visible, so smoothing a frame is a
+    single vectorized update over its faces. Rows of tracks missing from an
+    update are released, unless `release` is False; `retain` then releases
+    the tracks that left. Faces beyond `max_tracks` are returned unsmoothed.
+    """
+    def __init__(self, num_classes, alpha=0.3, max_tracks=32):
+        self.alpha = alpha
+        self.averages = np.zeros((max_tracks, num_classes), dtype=np.float32)
+        self.rows = {}
+        self.free_rows = list(range(max_tracks - 1, -1, -1))
+        self.lock = threading.Lock()
+
+    def _release_missing(self, track_ids):
+        visible_track_ids = set(track_ids)
+        for track_id in list(self.rows):
+            if track_id not in visible_track_ids:
+                self.free_rows.append(self.rows.pop(track_id))
+
+    def retain(self, track_ids):
+        """Releases the rows of every track not in `track_ids`."""
+        with self.lock:
+            self._release_missing(track_ids)
+
+    def get(self, track_ids):
+        """Returns a copy of the running average of every track, None for
+        tracks without one."""
+        with self.lock:
+            return [None if track_id not in self.rows
+                    else self.averages[self.rows[track_id]].copy()
+                    for track_id in track_ids]
+
+    def update(self, track_ids, probabilities, release=True):
+        """Blends `probabilities` (one row per track id) into the running
+        averages and returns the smoothed (N, num_classes) probabilities."""
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+        with self.lock:
+            if release:
+                self._release_missing(track_ids)
+
+            rows = np.empty(len(track_ids), dtype=int)
+            for face_arg, track_id in enumerate(track_ids):
+                row = self.rows.get(track_id)
+                if row is None and self.free_rows:
+                    row = self.free_rows.pop()
+                    self.rows[track_id] = row
+                    self.averages[row] = probabilities[face_arg]
+                rows[face_arg] = -1 if row is None else row
+
+            smoothed = probabilities.copy()
+            tracked = rows >= 0
+            tracked_rows = rows[tracked]
+            self.averages[tracked_rows] += self.alpha * (
+                probabilities[tracked] - self.averages[tracked_rows])
+            smoothed[tracked] = self.averages[tracked_rows]
+            return smoothed
@@ -0,0 +1,142 @@
+from itertools import count
+import threading
+
+import cv2
+import numpy as np
+
+from .inference import detect_faces
+from .inference import detect_faces_downscaled
+
+
+def compute_iou(box_a, box_b):
+    """Intersection over union of two (x, y, width, height) boxes."""
+    x1 = max(box_a[0], box_b[0])
+    y1 = max(box_a[1], box_b[1])
+    x2 = min(box_a[0] + box_a[2], box_b[0] + box_b[2])
+    y2 = min(box_a[1] + box_a[3], box_b[1] + box_b[3])
+    intersection = max(0, x2 - x1) * max(0, y2 - y1)
+    union = box_a[2] * box_a[3] + box_b[2] * box_b[3] - intersection
+    return intersection / float(union) if union > 0 else 0.0
+
+
+class FaceTracker(object):
+    """Keeps face boxes up to date between frames with sparse optical flow,
+    running the (much slower) cascade detector only every `detect_every`
+    frames or when a tracked face is lost.
+
+    Corner points are sampled inside every detected box and followed with
+    pyramidal Lucas-Kanade. Each box moves by the median displacement of
+    its points; the fraction of points still tracked is its confidence.
+    A box whose confidence drops below `min_confidence` is held in place
+    and forces a new detection on the next frame.
+
+    Every box carries a track id. Detected boxes overlapping a previous box
+    by at least `min_iou` keep its id, so per-face state can be keyed by
+    track across frames.
+
+    With `min_face_size` set, detection runs through
+    `detect_faces_downscaled` instead of on the full-resolution frame.
+    """
+    def __init__(self, detection_model, detect_every=5, min_confidence=0.5,
+                 max_points=20, min_face_size=None, min_iou=0.3):
+        self.detection_model = detection_model
+        self.min_iou = min_iou
+        self.track_id_counter = count()
+        self.min_face_size = min_face_size
+        self.detect_every = detect_every
+        self.min_confidence = min_confidence
+        self.max_points = max_points
+        self.lk_params = dict(winSize=(15, 15), maxLevel=2,
+                              criteria=(cv2.TERM_CRITERIA_EPS |
+                                        cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.previous_gray = None
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+        self.track_ids = []
+        self.points = []
+        self.frames_since_detection = 0
+        self.lost = True
+        self.num_frames = 0
+        self.num_detections = 0
+
+    def _sample_points(self, gray_image, box):
+        x, y, width, height = box.astype(int)
+        x, y = max(0, x), max(0, y)
+        gray_face = gray_image[y:y + height, x:x + width]
+        points = cv2.goodFeaturesToTrack(gray_face, self.max_points, 0.01, 3)
+        if points is None:
+            return np.zeros((0, 1, 2), dtype=np.float32)
+        return points + np.float32([x, y])
+
+    def _detect(self, gray_image):
+        if self.min_face_size is None:
+            faces = detect_faces(self.detection_model, gray_image)
+        else:
+            faces = detect_faces_downscaled(self.detection_model, gray_image,
+                                            self.min_face_size)
+        boxes = np.asarray(faces, dtype=np.float32).reshape(-1, 4)
+        self.track_ids = self._match_tracks(boxes)
+        self.boxes = boxes
+        self.points = [self._sample_points(gray_image, box)
+                       for box in self.boxes]
+        self.frames_since_detection = 0
+        self.num_detections = self.num_detections + 1
+        self.lost = False
+
+    def _match_tracks(self, boxes):
+        track_ids = []
+        unmatched = list(range(len(self.boxes)))
+        for box in boxes:
+            scores = [compute_iou(box, self.boxes[arg]) for arg in unmatched]
+            if len(scores) > 0 and max(scores) >= self.min_iou:
+                best_arg = unmatched.pop(int(np.argmax(scores)))
+                track_ids.append(self.track_ids[best_arg])
+            else:
+                track_ids.append(next(self.track_id_counter))
+        return track_ids
+
+    def _track(self, gray_image):
+        points = []
+        for box_arg, box_points in enumerate(self.points):
+            if len(box_points) == 0:
+                self.lost = True
+                points.append(box_points)
+                continue
+            next_points, status, error = cv2.calcOpticalFlowPyrLK(
+                self.previous_gray, gray_image, box_points, None,
+                **self.lk_params)
+            tracked = status.ravel() == 1
+            if tracked.mean() < self.min_confidence:
+                self.lost = True
+                points.append(box_points[:0])
+                continue
+            shift = np.median(next_points[tracked] - box_points[tracked],
+                              axis=0).ravel()
+            self.boxes[box_arg, :2] = self.boxes[box_arg, :2] + shift
+            points.append(next_points[tracked].reshape(-1, 1, 2))
+        self.points = points
+        self.frames_since_detection = self.frames_since_detection + 1
+
+    def update(self, gray_image):
+        """Returns the face boxes for `gray_image` as an (N, 4) int array of
+        (x, y, width, height), like `detect_faces`."""
+        return self.update_tracks(gray_image)[1]
+
+    def update_tracks(self, gray_image):
+        """Like `update`, but returns the list of track ids alongside the
+        boxes."""
+        with self.lock:
+            needs_detection = (self.lost or self.previous_gray is None or
+                               self.previous_gray.shape != gray_image.shape or
+                               self.frames_since_detection + 1 >=
+                               self.detect_every)
+            if needs_detection:
+                self._detect(gray_image)
+            else:
+                self._track(gray_image)
+            self.previous_gray = gray_image
+            self.num_frames = self.num_frames + 1
+            return list(self.track_ids), np.round(self.boxes).astype(int)
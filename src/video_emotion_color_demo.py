@@ -1,16 +1,18 @@
-from statistics import mode
+import time
 
 import cv2
 from keras.models import load_model
 import numpy as np
 
+from utils.batched_inference import BucketedPredictor
+from utils.classification_scheduler import ClassificationScheduler
 from utils.datasets import get_labels
-from utils.inference import detect_faces
 from utils.inference import draw_text
 from utils.inference import draw_bounding_box
-from utils.inference import apply_offsets
 from utils.inference import load_detection_model
-from utils.preprocessor import preprocess_input
+from utils.pipeline import Pipeline
+from utils.preprocessor import preprocess_faces
+from utils.tracker import FaceTracker
 
 # parameters for loading data and images
 detection_model_path = '../trained_models/detection_models/haarcascade_frontalface_default.xml'
@@ -18,74 +20,92 @@ emotion_model_path = '../trained_models/emotion_models/fer2013_mini_XCEPTION.102
 emotion_labels = get_labels('fer2013')
 
 # hyper-parameters for bounding boxes shape
-frame_window = 10
+detect_every = 5
 emotion_offsets = (20, 40)
 
 # loading models
 face_detection = load_detection_model(detection_model_path)
-emotion_classifier = load_model(emotion_model_path, compile=False)
+face_tracker = FaceTracker(face_detection, detect_every)
+emotion_classifier = BucketedPredictor(load_model(emotion_model_path, compile=False))
 
 # getting input model shapes for inference
 emotion_target_size = emotion_classifier.input_shape[1:3]
 
-# starting lists for calculating modes
-emotion_window = []
+# faces are classified again only as often as the time budget allows
+target_fps = 30
+cpu_budget = 0.5
+classification_scheduler = ClassificationScheduler(target_fps, cpu_budget)
 
-# starting video streaming
-cv2.namedWindow('window_frame')
-video_capture = cv2.VideoCapture(0)
-while True:
-    bgr_image = video_capture.read()[1]
+
+def detect(bgr_image):
     gray_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
-    rgb_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2RGB)
-    faces = detect_faces(face_detection, gray_image)
-
-    for face_coordinates in faces:
-
-        x1, x2, y1, y2 = apply_offsets(face_coordinates, emotion_offsets)
-        gray_face = gray_image[y1:y2, x1:x2]
-        try:
-            gray_face = cv2.resize(gray_face, (emotion_target_size))
-        except:
-            continue
-
-        gray_face = preprocess_input(gray_face, True)
-        gray_face = np.expand_dims(gray_face, 0)
-        gray_face = np.expand_dims(gray_face, -1)
-        emotion_prediction = emotion_classifier.predict(gray_face)
+    track_ids, faces = face_tracker.update_tracks(gray_image)
+    return bgr_image, gray_image, track_ids, faces
+
+
+def classify(item):
+    bgr_image, gray_image, track_ids, faces = item
+    # only the tracks picked by the scheduler are classified on this frame,
+    # the others keep their last smoothed result
+    start_time = time.perf_counter()
+    classify_args = classification_scheduler.select(track_ids)
+    classify_faces = [faces[face_arg] for face_arg in classify_args]
+    gray_faces, face_args = preprocess_faces(gray_image, classify_faces,
+                                             emotion_offsets,
+                                             emotion_target_size,
+                                             grayscale=True, v2=True)
+    if len(face_args) > 0:
+        emotion_predictions = emotion_classifier.predict(gray_faces)
+        classification_scheduler.update(
+            [track_ids[classify_args[face_arg]] for face_arg in face_args],
+            emotion_predictions, time.perf_counter() - start_time)
+
+    results = classification_scheduler.get(track_ids)
+    classified_args = [face_arg for face_arg, result in enumerate(results)
+                       if result is not None]
+    return (bgr_image, [faces[face_arg] for face_arg in classified_args],
+            [results[face_arg] for face_arg in classified_args])
+
+
+def render(item):
+    bgr_image, faces, emotion_predictions = item
+    # predictions are already smoothed per track by the scheduler
+    for face_coordinates, emotion_prediction in zip(faces,
+                                                    emotion_predictions):
         emotion_probability = np.max(emotion_prediction)
         emotion_label_arg = np.argmax(emotion_prediction)
         emotion_text = emotion_labels[emotion_label_arg]
-        emotion_window.append(emotion_text)
-
-        if len(emotion_window) > frame_window:
-            emotion_window.pop(0)
-        try:
-            emotion_mode = mode(emotion_window)
-        except:
-            continue
 
+        # colors are BGR, boxes are drawn straight onto the captured frame
         if emotion_text == 'angry':
-            color = emotion_probability * np.asarray((255, 0, 0))
-        elif emotion_text == 'sad':
             color = emotion_probability * np.asarray((0, 0, 255))
+        elif emotion_text == 'sad':
+            color = emotion_probability * np.asarray((255, 0, 0))
         elif emotion_text == 'happy':
-            color = emotion_probability * np.asarray((255, 255, 0))
-        elif emotion_text == 'surprise':
             color = emotion_probability * np.asarray((0, 255, 255))
+        elif emotion_text == 'surprise':
+            color = emotion_probability * np.asarray((255, 255, 0))
         else:
             color = emotion_probability * np.asarray((0, 255, 0))
 
         color = color.astype(int)
         color = color.tolist()
 
-        draw_bounding_box(face_coordinates, rgb_image, color)
-        draw_text(face_coordinates, rgb_image, emotion_mode,
+        draw_bounding_box(face_coordinates, bgr_image, color)
+        draw_text(face_coordinates, bgr_image, emotion_text,
                   color, 0, -45, 1, 1)
 
-    bgr_image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
     cv2.imshow('window_frame', bgr_image)
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
+    return cv2.waitKey(1) & 0xFF != ord('q')
+
+
+# starting video streaming, capture, detection, classification and display
+# each run on their own thread
+cv2.namedWindow('window_frame')
+video_capture = cv2.VideoCapture(0)
+pipeline = Pipeline(lambda: video_capture.read()[1],
+                    [('detect', detect), ('classify', classify),
+                     ('render', render)])
+pipeline.run()
 video_capture.release()
 cv2.destroyAllWindows()
@@ -1,16 +1,18 @@
-from statistics import mode
+import time
 
 import cv2
 from keras.models import load_model
 import numpy as np
 
+from utils.batched_inference import BucketedPredictor
+from utils.classification_scheduler import ClassificationScheduler
 from utils.datasets import get_labels
-from utils.inference import detect_faces
 from utils.inference import draw_text
 from utils.inference import draw_bounding_box
-from utils.inference import apply_offsets
 from utils.inference import load_detection_model
-from utils.preprocessor import preprocess_input
+from utils.pipeline import Pipeline
+from utils.preprocessor import preprocess_faces
+from utils.tracker import FaceTracker
 
 # parameters for loading data and images
 detection_model_path = '../trained_models/detection_models/haarcascade_frontalface_default.xml'
@@ -21,82 +23,101 @@ gender_labels = get_labels('imdb')
 font = cv2.FONT_HERSHEY_SIMPLEX
 
 # hyper-parameters for bounding boxes shape
-frame_window = 10
+detect_every = 5
 gender_offsets = (30, 60)
 emotion_offsets = (20, 40)
 
 # loading models
 face_detection = load_detection_model(detection_model_path)
-emotion_classifier = load_model(emotion_model_path, compile=False)
-gender_classifier = load_model(gender_model_path, compile=False)
+face_tracker = FaceTracker(face_detection, detect_every)
+emotion_classifier = BucketedPredictor(load_model(emotion_model_path, compile=False))
+gender_classifier = BucketedPredictor(load_model(gender_model_path, compile=False))
 
 # getting input model shapes for inference
 emotion_target_size = emotion_classifier.input_shape[1:3]
 gender_target_size = gender_classifier.input_shape[1:3]
 
-# starting lists for calculating modes
-gender_window = []
-emotion_window = []
+# faces are classified again only as often as the time budget allows
+target_fps = 30
+cpu_budget = 0.5
+num_emotions = len(emotion_labels)
+classification_scheduler = ClassificationScheduler(target_fps, cpu_budget)
 
-# starting video streaming
-cv2.namedWindow('window_frame')
-video_capture = cv2.VideoCapture(0)
-while True:
 
-    bgr_image = video_capture.read()[1]
+def detect(bgr_image):
     gray_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
-    rgb_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2RGB)
-    faces = detect_faces(face_detection, gray_image)
-
-    for face_coordinates in faces:
-
-        x1, x2, y1, y2 = apply_offsets(face_coordinates, gender_offsets)
-        rgb_face = rgb_image[y1:y2, x1:x2]
-
-        x1, x2, y1, y2 = apply_offsets(face_coordinates, emotion_offsets)
-        gray_face = gray_image[y1:y2, x1:x2]
-        try:
-            rgb_face = cv2.resize(rgb_face, (gender_target_size))
-            gray_face = cv2.resize(gray_face, (emotion_target_size))
-        except:
-            continue
-        gray_face = preprocess_input(gray_face, False)
-        gray_face = np.expand_dims(gray_face, 0)
-        gray_face = np.expand_dims(gray_face, -1)
-        emotion_label_arg = np.argmax(emotion_classifier.predict(gray_face))
+    track_ids, faces = face_tracker.update_tracks(gray_image)
+    return bgr_image, gray_image, track_ids, faces
+
+
+def classify(item):
+    bgr_image, gray_image, track_ids, faces = item
+    # only the tracks picked by the scheduler are classified on this frame,
+    # the others keep their last smoothed result
+    start_time = time.perf_counter()
+    classify_args = classification_scheduler.select(track_ids)
+    classify_faces = [faces[face_arg] for face_arg in classify_args]
+    # gender offsets enclose the emotion offsets, so every face with an
+    # emotion crop also has a gender crop
+    gray_faces, face_args = preprocess_faces(gray_image, classify_faces,
+                                             emotion_offsets,
+                                             emotion_target_size,
+                                             grayscale=True, v2=False)
+    classify_faces = [classify_faces[face_arg] for face_arg in face_args]
+    classify_track_ids = [track_ids[classify_args[face_arg]]
+                          for face_arg in face_args]
+    rgb_faces, face_args = preprocess_faces(bgr_image, classify_faces,
+                                            gender_offsets,
+                                            gender_target_size, v2=False)
+    if len(classify_faces) > 0:
+        emotion_predictions = emotion_classifier.predict(gray_faces)
+        gender_predictions = gender_classifier.predict(rgb_faces)
+        classification_scheduler.update(
+            classify_track_ids,
+            np.concatenate([emotion_predictions, gender_predictions], axis=1),
+            time.perf_counter() - start_time)
+
+    results = classification_scheduler.get(track_ids)
+    classified_args = [face_arg for face_arg, result in enumerate(results)
+                       if result is not None]
+    return (bgr_image, [faces[face_arg] for face_arg in classified_args],
+            [results[face_arg] for face_arg in classified_args])
+
+
+def render(item):
+    bgr_image, faces, predictions = item
+    # predictions are already smoothed per track by the scheduler
+    for face_coordinates, prediction in zip(faces, predictions):
+
+        emotion_label_arg = np.argmax(prediction[:num_emotions])
         emotion_text = emotion_labels[emotion_label_arg]
-        emotion_window.append(emotion_text)
 
-        rgb_face = np.expand_dims(rgb_face, 0)
-        rgb_face = preprocess_input(rgb_face, False)
-        gender_prediction = gender_classifier.predict(rgb_face)
-        gender_label_arg = np.argmax(gender_prediction)
+        gender_label_arg = np.argmax(prediction[num_emotions:])
         gender_text = gender_labels[gender_label_arg]
-        gender_window.append(gender_text)
-
-        if len(gender_window) > frame_window:
-            emotion_window.pop(0)
-            gender_window.pop(0)
-        try:
-            emotion_mode = mode(emotion_window)
-            gender_mode = mode(gender_window)
-        except:
-            continue
 
+        # colors are BGR, boxes are drawn straight onto the captured frame
         if gender_text == gender_labels[0]:
-            color = (0, 0, 255)
-        else:
             color = (255, 0, 0)
+        else:
+            color = (0, 0, 255)
 
-        draw_bounding_box(face_coordinates, rgb_image, color)
-        draw_text(face_coordinates, rgb_image, gender_mode,
+        draw_bounding_box(face_coordinates, bgr_image, color)
+        draw_text(face_coordinates, bgr_image, gender_text,
                   color, 0, -20, 1, 1)
-        draw_text(face_coordinates, rgb_image, emotion_mode,
+        draw_text(face_coordinates, bgr_image, emotion_text,
                   color, 0, -45, 1, 1)
 
-    bgr_image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
     cv2.imshow('window_frame', bgr_image)
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
+    return cv2.waitKey(1) & 0xFF != ord('q')
+
+
+# starting video streaming, capture, detection, classification and display
+# each run on their own thread
+cv2.namedWindow('window_frame')
+video_capture = cv2.VideoCapture(0)
+pipeline = Pipeline(lambda: video_capture.read()[1],
+                    [('detect', detect), ('classify', classify),
+                     ('render', render)])
+pipeline.run()
 video_capture.release()
 cv2.destroyAllWindows()
@@ -11,6 +11,7 @@ from utils.grad_cam import calculate_guided_gradient_CAM
 from utils.inference import detect_faces
 from utils.inference import apply_offsets
 from utils.inference import load_detection_model
+from utils.pipeline import Pipeline
 from utils.preprocessor import preprocess_input
 from utils.inference import draw_bounding_box
 from utils.datasets import get_class_to_arg
@@ -50,15 +51,16 @@ target_size = model.input_shape[1:3]
 # starting lists for calculating modes
 emotion_window = []
 
-# starting video streaming
-cv2.namedWindow('window_frame')
-video_capture = cv2.VideoCapture(0)
-while True:
-    bgr_image = video_capture.read()[1]
+
+def detect(bgr_image):
     gray_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
-    rgb_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2RGB)
     faces = detect_faces(face_detection, gray_image)
+    return bgr_image, gray_image, faces
+
 
+def guided_gradcam(item):
+    bgr_image, gray_image, faces = item
+    rgb_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2RGB)
     for face_coordinates in faces:
 
         x1, x2, y1, y2 = apply_offsets(face_coordinates, offsets)
@@ -81,12 +83,24 @@ while True:
         except:
             continue
         draw_bounding_box((x1, y1, x2 - x1, y2 - y1), rgb_image, color)
-    bgr_image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
+    return cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
+
+
+def render(bgr_image):
     try:
         cv2.imshow('window_frame', bgr_image)
     except:
-        continue
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
+        return True
+    return cv2.waitKey(1) & 0xFF != ord('q')
 
 
+# starting video streaming, capture, detection, guided Grad-CAM and display
+# each run on their own thread
+cv2.namedWindow('window_frame')
+video_capture = cv2.VideoCapture(0)
+pipeline = Pipeline(lambda: video_capture.read()[1],
+                    [('detect', detect), ('gradcam', guided_gradcam),
+                     ('render', render)])
+pipeline.run()
+video_capture.release()
+cv2.destroyAllWindows()
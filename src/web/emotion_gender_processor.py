@@ -1,4 +1,3 @@
-import os
 import sys
 import logging
 
@@ -6,89 +5,113 @@ import cv2
 from keras.models import load_model
 import numpy as np
 
+from utils.batched_inference import BucketedPredictor
 from utils.datasets import get_labels
 from utils.inference import detect_faces
 from utils.inference import draw_text
 from utils.inference import draw_bounding_box
-from utils.inference import apply_offsets
 from utils.inference import load_detection_model
 from utils.inference import load_image
-from utils.preprocessor import preprocess_input
-
-def process_image(image):
+from utils.model_registry import registry
+from utils.preprocessor import preprocess_faces
+
+# parameters for loading data and images
+detection_model_path = './trained_models/detection_models/haarcascade_frontalface_default.xml'
+emotion_model_path = './trained_models/emotion_models/fer2013_mini_XCEPTION.102-0.66.hdf5'
+gender_model_path = './trained_models/gender_models/simple_CNN.81-0.96.hdf5'
+emotion_labels = get_labels('fer2013')
+gender_labels = get_labels('imdb')
+font = cv2.FONT_HERSHEY_SIMPLEX
+
+# hyper-parameters for bounding boxes shape
+gender_offsets = (30, 60)
+gender_offsets = (10, 10)
+emotion_offsets = (20, 40)
+emotion_offsets = (0, 0)
+
+# models are loaded once per process and shared by every request
+registry.register('face_detection',
+                  lambda: load_detection_model(detection_model_path),
+                  lambda model: detect_faces(model, np.zeros((64, 64), np.uint8)))
+# classifiers run through a traced function per batch size bucket instead
+# of paying for `predict` on every face
+registry.register('emotion_classifier',
+                  lambda: BucketedPredictor(load_model(emotion_model_path, compile=False)),
+                  lambda model: model.warmup())
+registry.register('gender_classifier',
+                  lambda: BucketedPredictor(load_model(gender_model_path, compile=False)),
+                  lambda model: model.warmup())
+
+# annotated images are encoded in memory in one of these formats. `quality`
+# is the JPEG quality (0-100) or the PNG compression level (0-9)
+image_formats = {
+    'png': ('.png', 'image/png', cv2.IMWRITE_PNG_COMPRESSION, 1),
+    'jpeg': ('.jpg', 'image/jpeg', cv2.IMWRITE_JPEG_QUALITY, 90),
+}
+
+def encode_image(bgr_image, image_format='png', quality=None):
+    """Returns `bgr_image` encoded in `image_format` and its mimetype."""
+    extension, mimetype, quality_flag, default_quality = image_formats[image_format]
+    if quality is None:
+        quality = default_quality
+    success, encoded_image = cv2.imencode(extension, bgr_image,
+                                          [quality_flag, int(quality)])
+    if not success:
+        raise ValueError('Could not encode image as {0}'.format(image_format))
+    return encoded_image.tobytes(), mimetype
+
+def process_image(image, image_format='png', quality=None):
+    """Classifies every face in the encoded `image` and returns the
+    annotated image, encoded in memory, with its mimetype. Raises
+    `ModelUnavailable` when a model could not be loaded."""
+    if image_format not in image_formats:
+        raise ValueError('Unsupported image format: {0}'.format(image_format))
+
+    # loading images
+    bgr_image = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+    if bgr_image is None:
+        raise ValueError('Could not decode image')
+
+    # loading models, a model that failed to load is not a per-face error
+    face_detection = registry.get('face_detection')
+    emotion_classifier = registry.get('emotion_classifier')
+    gender_classifier = registry.get('gender_classifier')
 
     try:
-        # parameters for loading data and images
-        detection_model_path = './trained_models/detection_models/haarcascade_frontalface_default.xml'
-        emotion_model_path = './trained_models/emotion_models/fer2013_mini_XCEPTION.102-0.66.hdf5'
-        gender_model_path = './trained_models/gender_models/simple_CNN.81-0.96.hdf5'
-        emotion_labels = get_labels('fer2013')
-        gender_labels = get_labels('imdb')
-        font = cv2.FONT_HERSHEY_SIMPLEX
-
-        # hyper-parameters for bounding boxes shape
-        gender_offsets = (30, 60)
-        gender_offsets = (10, 10)
-        emotion_offsets = (20, 40)
-        emotion_offsets = (0, 0)
-
-        # loading models
-        face_detection = load_detection_model(detection_model_path)
-        emotion_classifier = load_model(emotion_model_path, compile=False)
-        gender_classifier = load_model(gender_model_path, compile=False)
-
         # getting input model shapes for inference
         emotion_target_size = emotion_classifier.input_shape[1:3]
         gender_target_size = gender_classifier.input_shape[1:3]
 
-        # loading images
-        image_array = np.fromstring(image, np.uint8)
-        unchanged_image = cv2.imdecode(image_array, cv2.IMREAD_UNCHANGED)
-
-        rgb_image = cv2.cvtColor(unchanged_image, cv2.COLOR_BGR2RGB)
-        gray_image = cv2.cvtColor(unchanged_image, cv2.COLOR_BGR2GRAY)
-
+        gray_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
         faces = detect_faces(face_detection, gray_image)
-        for face_coordinates in faces:
-            x1, x2, y1, y2 = apply_offsets(face_coordinates, gender_offsets)
-            rgb_face = rgb_image[y1:y2, x1:x2]
-
-            x1, x2, y1, y2 = apply_offsets(face_coordinates, emotion_offsets)
-            gray_face = gray_image[y1:y2, x1:x2]
-
-            try:
-                rgb_face = cv2.resize(rgb_face, (gender_target_size))
-                gray_face = cv2.resize(gray_face, (emotion_target_size))
-            except:
-                continue
-
-            rgb_face = preprocess_input(rgb_face, False)
-            rgb_face = np.expand_dims(rgb_face, 0)
-            gender_prediction = gender_classifier.predict(rgb_face)
-            gender_label_arg = np.argmax(gender_prediction)
-            gender_text = gender_labels[gender_label_arg]
-
-            gray_face = preprocess_input(gray_face, True)
-            gray_face = np.expand_dims(gray_face, 0)
-            gray_face = np.expand_dims(gray_face, -1)
-            emotion_label_arg = np.argmax(emotion_classifier.predict(gray_face))
-            emotion_text = emotion_labels[emotion_label_arg]
 
+        # every face goes into one batch per model, so each model runs
+        # once per image. Gender offsets enclose the emotion offsets, so
+        # every face with an emotion crop also has a gender crop
+        gray_faces, face_args = preprocess_faces(
+            gray_image, faces, emotion_offsets, emotion_target_size,
+            grayscale=True, v2=True)
+        faces = [faces[face_arg] for face_arg in face_args]
+        rgb_faces, face_args = preprocess_faces(
+            bgr_image, faces, gender_offsets, gender_target_size, v2=False)
+        if len(faces) > 0:
+            emotion_predictions = emotion_classifier.predict(gray_faces)
+            gender_predictions = gender_classifier.predict(rgb_faces)
+
+        for face_arg, face_coordinates in enumerate(faces):
+            gender_text = gender_labels[np.argmax(gender_predictions[face_arg])]
+            emotion_text = emotion_labels[np.argmax(emotion_predictions[face_arg])]
+
+            # colors are BGR, boxes are drawn straight onto the decoded image
             if gender_text == gender_labels[0]:
-                color = (0, 0, 255)
-            else:
                 color = (255, 0, 0)
+            else:
+                color = (0, 0, 255)
 
-            draw_bounding_box(face_coordinates, rgb_image, color)
-            draw_text(face_coordinates, rgb_image, gender_text, color, 0, -20, 1, 2)
-            draw_text(face_coordinates, rgb_image, emotion_text, color, 0, -50, 1, 2)
+            draw_bounding_box(face_coordinates, bgr_image, color)
+            draw_text(face_coordinates, bgr_image, gender_text, color, 0, -20, 1, 2)
+            draw_text(face_coordinates, bgr_image, emotion_text, color, 0, -50, 1, 2)
     except Exception as err:
         logging.error('Error in emotion gender processor: "{0}"'.format(err))
 
-    bgr_image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
-
-    dirname = 'result'
-    if not os.path.exists(dirname):
-        os.mkdir(dirname)
-
-    cv2.imwrite(os.path.join(dirname, 'predicted_image.png'), bgr_image)
+    return encode_image(bgr_image, image_format, quality)
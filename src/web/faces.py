@@ -1,20 +1,36 @@
-from flask import Flask, jsonify, make_response, request, abort, redirect, send_file
+from flask import Flask, Response, jsonify, make_response, request, abort, redirect
 import logging
 
 import emotion_gender_processor as eg_processor
+from utils.model_registry import ModelUnavailable
+from utils.model_registry import registry
 
 app = Flask(__name__)
+# load and warm every model in the background, /ready reports when done
+registry.start_warmup()
 
 @app.route('/')
 def index():
     return redirect("https://ekholabs.ai", code=302)
 
+@app.route('/ready')
+def ready():
+    status = registry.status()
+    return make_response(jsonify(status), 200 if status['ready'] else 503)
+
 @app.route('/classifyImage', methods=['POST'])
 def upload():
     try:
         image = request.files['image'].read()
-        eg_processor.process_image(image)
-        return send_file('/ekholabs/face-classifier/result/predicted_image.png', mimetype='image/png')
+        # ?format=jpeg&quality=80 trades exact pixels for a much faster encode
+        image_format = request.values.get('format', 'png').lower()
+        image_format = 'jpeg' if image_format == 'jpg' else image_format
+        quality = request.values.get('quality', type=int)
+        annotated_image, mimetype = eg_processor.process_image(image, image_format, quality)
+        return Response(annotated_image, mimetype=mimetype)
+    except ModelUnavailable as err:
+        logging.error('A model is unavailable: "{0}"'.format(err))
+        abort(503)
     except Exception as err:
         logging.error('An error has occurred whilst processing the file: "{0}"'.format(err))
         abort(400)
@@ -23,6 +39,10 @@ def upload():
 def bad_request(erro):
     return make_response(jsonify({'error': 'We cannot process the file sent in the request.'}), 400)
 
+@app.errorhandler(503)
+def service_unavailable(error):
+    return make_response(jsonify({'error': 'The models are not available, try again later.'}), 503)
+
 @app.errorhandler(404)
 def not_found(error):
     return make_response(jsonify({'error': 'Resource no found.'}), 404)